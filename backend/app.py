@@ -3,17 +3,25 @@
 基于长桥API的量化分析平台
 """
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os
 import json
+import time
 import secrets
+import threading
+import logging
 import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Optional, Tuple
 import traceback
+import io
+import hashlib
+import uuid
 from decimal import Decimal
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
 # 长桥API
 from longport.openapi import Config, QuoteContext, TradeContext
@@ -22,18 +30,47 @@ from longport.openapi import Config, QuoteContext, TradeContext
 from auth_service import AuthService
 from sms_service import AliyunSMS
 
+# 因子数值内核
+from factors_core import rolling_mean, rolling_mean_std, rolling_max, rolling_min_drawdown, backtest_kernel, session_stats
+
 # 机器学习
 from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import r2_score, mean_squared_error
+from scipy.linalg import cho_factor, cho_solve
+from scipy.stats import rankdata
 import lightgbm as lgb
 import xgboost as xgb
 
+# 尝试导入orjson，如果没有则使用Flask自带的jsonify
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# 尝试导入whitenoise，如果没有则由Flask路由服务静态文件
+try:
+    from whitenoise import WhiteNoise
+    WHITENOISE_AVAILABLE = True
+except ImportError:
+    WHITENOISE_AVAILABLE = False
+
+# pandas 写时复制：切片/列选取不再立即复制数据，只读使用的DataFrame无需手动 copy()
+pd.set_option('mode.copy_on_write', True)
+
 app = Flask(__name__)
 CORS(app)
 
+# 日志级别通过环境变量 LOG_LEVEL 配置（默认INFO，DEBUG日志不格式化也不输出）
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='[%(levelname)s] %(message)s'
+)
+logger = logging.getLogger(__name__)
+
 # ============== 阿里云SMS短信服务配置 ==============
 # 方式1：环境变量配置（推荐，安全）
 # 在启动服务前设置环境变量：
@@ -46,6 +83,7 @@ CORS(app)
 
 # 初始化Redis连接（如果可用）
 redis_client = None
+redis_cache = None  # 二进制客户端，用于缓存行情/因子 DataFrame
 try:
     import redis
     redis_client = redis.Redis(
@@ -55,10 +93,30 @@ try:
         socket_connect_timeout=5
     )
     redis_client.ping()
+    redis_cache = redis.Redis(
+        host='localhost',
+        port=6379,
+        decode_responses=False,
+        socket_connect_timeout=5
+    )
     print("[INFO] Redis连接成功，验证码将持久化存储")
 except Exception as e:
     print(f"[WARNING] Redis连接失败: {e}，使用内存存储（服务器重启后验证码会丢失）")
     redis_client = None
+    redis_cache = None
+
+# 行情/因子缓存有效期（秒）
+QUOTES_CACHE_TTL = int(os.environ.get('QUOTES_CACHE_TTL', '300'))
+FACTORS_CACHE_TTL = int(os.environ.get('FACTORS_CACHE_TTL', '300'))
+# 日K线历史缓存：保留较长时间，之后只增量请求最新的K线
+QUOTES_HISTORY_TTL = int(os.environ.get('QUOTES_HISTORY_TTL', str(7 * 24 * 3600)))
+QUOTES_INCREMENTAL_OVERLAP = 2  # 增量请求时与缓存重叠的K线数，用于校验复权基准
+
+# 每个模型训练使用的线程数，默认1，避免并发请求时多个模型争抢全部CPU核
+ML_N_JOBS = int(os.environ.get('LGB_THREADS', '1'))
+
+# 回测累计净值曲线返回给前端的最大点数
+BACKTEST_CURVE_MAX_POINTS = 500
 
 # 读取环境变量
 ALIYUN_ACCESS_KEY_ID = os.environ.get('ALIYUN_ACCESS_KEY_ID', '')
@@ -91,7 +149,19 @@ def convert_to_native(obj):
     # 处理 None
     if obj is None:
         return None
-    
+
+    # 数值型 numpy 数组 / pandas Series：一次向量化转换，避免逐元素递归
+    # datetime64/timedelta64/object 等仍走下面的逐元素路径，保持原有输出
+    if isinstance(obj, pd.Series) and obj.dtype.kind in 'fiub':
+        obj = obj.to_numpy()
+    if isinstance(obj, np.ndarray) and obj.dtype.kind in 'fiub':
+        if obj.dtype.kind != 'f':
+            return obj.tolist()
+        mask = ~np.isfinite(obj)
+        arr = obj.astype(np.float64).astype(object)
+        arr[mask] = None
+        return arr.tolist()
+
     # 处理 float NaN/Inf
     if isinstance(obj, float):
         if math.isnan(obj) or math.isinf(obj):
@@ -139,10 +209,121 @@ def convert_to_native(obj):
     
     return obj
 
+def _orjson_default(obj):
+    """orjson 不能直接序列化的类型（Decimal、Timestamp 等）"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    if hasattr(obj, 'item') and callable(getattr(obj, 'item')):
+        return obj.item()
+    raise TypeError
+
+def ojsonify(obj) -> Response:
+    """
+    用 orjson 直接序列化结果（numpy 数组/标量原生支持，NaN/Inf 输出为 null），
+    省去 convert_to_native 的递归转换；未安装 orjson 时退回 jsonify
+    """
+    if not ORJSON_AVAILABLE:
+        return jsonify(convert_to_native(obj))
+    return Response(
+        orjson.dumps(obj, default=_orjson_default,
+                     option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS),
+        mimetype='application/json'
+    )
+
+# ============== DataFrame 缓存（Redis，不可用时进程内LRU） ==============
+
+# Redis不可用时的进程内缓存：key -> (过期时间, DataFrame)，按最近使用顺序淘汰
+LOCAL_CACHE_MAX_ENTRIES = 128
+_local_cache: "OrderedDict[str, Tuple[float, pd.DataFrame]]" = OrderedDict()
+_local_cache_lock = threading.Lock()
+
+def _df_to_bytes(df: pd.DataFrame) -> bytes:
+    """
+    把DataFrame按列序列化为 npz（不使用 pickle，读取时 allow_pickle=False，缓存内容无法执行代码）：
+    数值/布尔列原样保存；日期列（含带时区）保存为 int64 纳秒加时区标记；
+    其他类型的列抛出 TypeError，由调用方跳过缓存
+    """
+    kinds = []
+    arrays = {}
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        if isinstance(series.dtype, pd.DatetimeTZDtype) or series.dtype.kind == 'M':
+            index = pd.DatetimeIndex(series).as_unit('ns')
+            kinds.append(f"M8:{index.tz}" if index.tz is not None else "M8")
+            arrays[f"c{i}"] = index.asi8
+        elif series.dtype.kind in 'fiub':
+            kinds.append("")
+            arrays[f"c{i}"] = series.to_numpy()
+        else:
+            raise TypeError(f"列 {col!r} 的类型 {series.dtype} 不支持缓存")
+    arrays["__columns__"] = np.array([str(c) for c in df.columns])
+    arrays["__kinds__"] = np.array(kinds)
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+    return buf.getvalue()
+
+def _df_from_bytes(data: bytes) -> pd.DataFrame:
+    """_df_to_bytes 的逆过程"""
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        columns = {}
+        for i, (col, kind) in enumerate(zip(npz["__columns__"].tolist(), npz["__kinds__"].tolist())):
+            values = npz[f"c{i}"]
+            if kind == "M8":
+                values = values.view('M8[ns]')
+            elif kind.startswith("M8:"):
+                values = pd.DatetimeIndex(values.view('M8[ns]')).tz_localize('UTC').tz_convert(kind[3:])
+            columns[col] = values
+        return pd.DataFrame(columns)
+
+def _cache_get(key: str) -> Optional[pd.DataFrame]:
+    """从Redis（或进程内缓存）读取缓存的DataFrame，未命中时返回None"""
+    if redis_cache is None:
+        with _local_cache_lock:
+            entry = _local_cache.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del _local_cache[key]
+                return None
+            _local_cache.move_to_end(key)
+        # 返回副本，避免调用方修改缓存中的对象
+        return entry[1].copy()
+    try:
+        data = redis_cache.get(key)
+        return _df_from_bytes(data) if data else None
+    except Exception as e:
+        print(f"[WARNING] 读取缓存失败 {key}: {e}", flush=True)
+        return None
+
+def _cache_set(key: str, df: pd.DataFrame, ttl: int):
+    """把DataFrame写入Redis缓存（Redis不可用时写入进程内缓存）"""
+    if df is None or df.empty:
+        return
+    if redis_cache is None:
+        with _local_cache_lock:
+            _local_cache[key] = (time.time() + ttl, df.copy())
+            _local_cache.move_to_end(key)
+            while len(_local_cache) > LOCAL_CACHE_MAX_ENTRIES:
+                _local_cache.popitem(last=False)
+        return
+    try:
+        redis_cache.setex(key, ttl, _df_to_bytes(df))
+    except Exception as e:
+        print(f"[WARNING] 写入缓存失败 {key}: {e}", flush=True)
+
 # ============== 长桥API连接管理（实时创建）==============
 
 user_configs = {}  # 保留兼容，但不再依赖
 
+# 已验证的长桥连接池：user_id -> (验证时间, 最近使用时间, Config, QuoteContext)
+# 每个用户只建立一次连接，过了验证有效期也在原连接上重新验证，不重新握手
+CTX_CACHE_TTL = 300  # 5分钟内不重复验证
+_ctx_cache: Dict[str, Tuple[float, float, Config, QuoteContext]] = {}
+_ctx_lock = threading.Lock()
+_ctx_user_locks: Dict[str, threading.Lock] = {}  # 同一用户的连接只由一个线程创建
+
 def get_current_user_id():
     """从请求头获取当前用户ID"""
     auth_header = request.headers.get('Authorization', '')
@@ -162,22 +343,131 @@ def create_config_for_user(user_id: str):
     if not user_id:
         return None, "用户ID为空"
     
-    creds = auth_service.get_longport_credentials(user_id)
-    if not creds:
-        return None, "未绑定长桥API凭证，请先绑定"
-    
-    try:
-        config = Config(
-            app_key=creds['api_key'],
-            app_secret=creds['api_secret'],
-            access_token=creds['access_token']
-        )
-        # 验证连接
-        ctx = QuoteContext(config)
-        ctx.quote(["AAPL.US"])
-        return config, None
-    except Exception as e:
-        return None, f"长桥API连接失败: {str(e)}"
+    # 验证未过期时直接复用，跳过验证请求
+    now = time.time()
+    with _ctx_lock:
+        entry = _ctx_cache.get(user_id)
+        if entry:
+            _ctx_cache[user_id] = (entry[0], now, entry[2], entry[3])
+        user_lock = _ctx_user_locks.setdefault(user_id, threading.Lock())
+    if entry and now - entry[0] < CTX_CACHE_TTL:
+        return entry[2], None
+    
+    with user_lock:
+        # 等锁期间其他线程可能已完成验证
+        with _ctx_lock:
+            entry = _ctx_cache.get(user_id)
+        if entry and time.time() - entry[0] < CTX_CACHE_TTL:
+            return entry[2], None
+        
+        if entry:
+            # 在已有连接上重新验证；失败（如凭证失效）则丢弃连接重新创建
+            try:
+                entry[3].quote(["AAPL.US"])
+                now = time.time()
+                with _ctx_lock:
+                    _ctx_cache[user_id] = (now, now, entry[2], entry[3])
+                return entry[2], None
+            except Exception as e:
+                print(f"[WARNING] 长桥连接重新验证失败，重新创建: {e}", flush=True)
+                with _ctx_lock:
+                    _ctx_cache.pop(user_id, None)
+        
+        creds = auth_service.get_longport_credentials(user_id)
+        if not creds:
+            return None, "未绑定长桥API凭证，请先绑定"
+        
+        try:
+            config = Config(
+                app_key=creds['api_key'],
+                app_secret=creds['api_secret'],
+                access_token=creds['access_token']
+            )
+            # 验证连接
+            ctx = QuoteContext(config)
+            ctx.quote(["AAPL.US"])
+            now = time.time()
+            with _ctx_lock:
+                _ctx_cache[user_id] = (now, now, config, ctx)
+            return config, None
+        except Exception as e:
+            return None, f"长桥API连接失败: {str(e)}"
+
+def get_user_quote_context(user_id: str) -> Optional[QuoteContext]:
+    """获取 create_config_for_user 缓存的已验证 QuoteContext，没有则返回None"""
+    with _ctx_lock:
+        entry = _ctx_cache.get(user_id)
+    return entry[3] if entry else None
+
+def invalidate_user_config(user_id: str):
+    """凭证变更后清除该用户的连接缓存"""
+    with _ctx_lock:
+        _ctx_cache.pop(user_id, None)
+    with _agent_lock:
+        _agent_pool.pop(user_id, None)
+
+# DataAgent 池：user_id -> (最近使用时间, DataAgent)，跨请求复用连接和股票信息缓存
+AGENT_IDLE_TTL = 600  # 闲置10分钟后回收
+_agent_pool: Dict[str, Tuple[float, 'DataAgent']] = {}
+_agent_lock = threading.Lock()
+
+def get_agent(user_id: str, config: Config) -> 'DataAgent':
+    """
+    获取用户的 DataAgent，优先复用池中的实例
+    
+    config 应来自 create_config_for_user；连接缓存刷新后 config 会变化，此时重新创建
+    """
+    now = time.time()
+    with _agent_lock:
+        entry = _agent_pool.get(user_id)
+        if entry and entry[1].config is config and now - entry[0] < AGENT_IDLE_TTL:
+            _agent_pool[user_id] = (now, entry[1])
+            return entry[1]
+    
+    agent = DataAgent(config, get_user_quote_context(user_id))
+    with _agent_lock:
+        _agent_pool[user_id] = (now, agent)
+    return agent
+
+def _close_context(ctx):
+    """关闭长桥上下文的连接（SDK 没有 close 时释放引用即断开）"""
+    close = getattr(ctx, 'close', None)
+    if callable(close):
+        try:
+            close()
+        except Exception as e:
+            print(f"[WARNING] 关闭长桥连接失败: {e}", flush=True)
+
+def _evict_idle_agents():
+    """后台线程：定期回收闲置的 DataAgent 和长桥连接"""
+    while True:
+        time.sleep(60)
+        now = time.time()
+        closing = []
+        with _agent_lock:
+            for user_id in [u for u, (used, _) in _agent_pool.items() if now - used >= AGENT_IDLE_TTL]:
+                agent = _agent_pool.pop(user_id)[1]
+                if agent._trade_ctx is not None:
+                    closing.append(agent._trade_ctx)
+        with _ctx_lock:
+            for user_id, entry in list(_ctx_cache.items()):
+                if now - entry[1] < AGENT_IDLE_TTL:
+                    continue
+                # 该用户正在创建/重新验证连接时跳过，下一轮再回收；用户锁本身保留，
+                # 保证同一用户始终只有一把锁、只有一个线程创建连接
+                user_lock = _ctx_user_locks.get(user_id)
+                if user_lock is not None and not user_lock.acquire(blocking=False):
+                    continue
+                try:
+                    del _ctx_cache[user_id]
+                    closing.append(entry[3])
+                finally:
+                    if user_lock is not None:
+                        user_lock.release()
+        for ctx in closing:
+            _close_context(ctx)
+
+threading.Thread(target=_evict_idle_agents, name='agent-evictor', daemon=True).start()
 
 # ============== 以下是原代码 ==============
 
@@ -202,10 +492,19 @@ def validate_api_config(config: Config) -> Tuple[bool, str]:
 class DataAgent:
     """数据获取Agent - 负责所有长桥API数据获取"""
     
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, quote_ctx: Optional[QuoteContext] = None,
+                 trade_ctx: Optional[TradeContext] = None):
         self.config = config
-        self.quote_ctx = QuoteContext(config)
-        self.trade_ctx = TradeContext(config)
+        # 可传入已创建的上下文复用连接
+        self.quote_ctx = quote_ctx if quote_ctx is not None else QuoteContext(config)
+        self._trade_ctx = trade_ctx
+    
+    @property
+    def trade_ctx(self) -> TradeContext:
+        """交易上下文，首次使用时才创建（只有持仓查询需要）"""
+        if self._trade_ctx is None:
+            self._trade_ctx = TradeContext(self.config)
+        return self._trade_ctx
     
     def get_watchlist(self) -> List[Dict]:
         """获取用户关注列表"""
@@ -238,24 +537,26 @@ class DataAgent:
                         group_id = getattr(group, 'id', '')
                         securities = getattr(group, 'securities', [])
                     
+                    if not securities:
+                        continue
+                    
+                    # 根据第一条记录确定取值方式，循环内不再逐条判断类型
+                    if isinstance(securities[0], dict):
+                        get_fields = lambda x: (x.get('symbol', ''), x.get('name', ''), str(x.get('market', '')))
+                    else:
+                        get_fields = lambda x: (getattr(x, 'symbol', ''), getattr(x, 'name', ''),
+                                                str(getattr(x, 'market', '')))
+                    
                     for item in securities:
                         try:
-                            if isinstance(item, dict):
-                                watchlist.append({
-                                    "symbol": item.get('symbol', ''),
-                                    "name": item.get('name', ''),
-                                    "group": group_name,
-                                    "group_id": group_id,
-                                    "market": str(item.get('market', ''))
-                                })
-                            else:
-                                watchlist.append({
-                                    "symbol": getattr(item, 'symbol', ''),
-                                    "name": getattr(item, 'name', ''),
-                                    "group": group_name,
-                                    "group_id": group_id,
-                                    "market": str(getattr(item, 'market', ''))
-                                })
+                            symbol, name, market = get_fields(item)
+                            watchlist.append({
+                                "symbol": symbol,
+                                "name": name,
+                                "group": group_name,
+                                "group_id": group_id,
+                                "market": market
+                            })
                         except Exception as e:
                             print(f"[DEBUG] 解析关注项失败: {e}", flush=True)
                             continue
@@ -301,16 +602,21 @@ class DataAgent:
                     else:
                         positions = getattr(channel, 'positions', [])
                     
+                    if not positions:
+                        continue
+                    
+                    # 根据第一条记录确定取值方式
+                    if isinstance(positions[0], dict):
+                        get_position = lambda x: (x.get('symbol', ''), x.get('quantity', 0), x.get('cost_price', 0))
+                    else:
+                        get_position = lambda x: (getattr(x, 'symbol', ''), getattr(x, 'quantity', 0),
+                                                  getattr(x, 'cost_price', 0))
+                    
                     for pos in positions:
                         try:
-                            if isinstance(pos, dict):
-                                symbol = pos.get('symbol', '')
-                                quantity = float(pos.get('quantity', 0))
-                                cost_price = float(pos.get('cost_price', 0))
-                            else:
-                                symbol = getattr(pos, 'symbol', '')
-                                quantity = float(getattr(pos, 'quantity', 0))
-                                cost_price = float(getattr(pos, 'cost_price', 0))
+                            symbol, quantity, cost_price = get_position(pos)
+                            quantity = float(quantity)
+                            cost_price = float(cost_price)
                             
                             if symbol and quantity > 0:
                                 symbols_to_quote.append(symbol)
@@ -332,26 +638,30 @@ class DataAgent:
             
             if symbols_to_quote:
                 try:
-                    # 分批获取行情，每批最多50只
+                    # 分批获取行情，每批最多50只，多批并发请求
                     batch_size = 50
-                    quotes = []
-                    for i in range(0, len(symbols_to_quote), batch_size):
-                        batch = symbols_to_quote[i:i+batch_size]
-                        batch_quotes = self.quote_ctx.quote(batch)
-                        if batch_quotes:
-                            quotes.extend(batch_quotes)
+                    batches = [symbols_to_quote[i:i+batch_size]
+                               for i in range(0, len(symbols_to_quote), batch_size)]
+                    if len(batches) == 1:
+                        batch_results = [self.quote_ctx.quote(batches[0])]
+                    else:
+                        with ThreadPoolExecutor(max_workers=min(4, len(batches))) as executor:
+                            batch_results = list(executor.map(self.quote_ctx.quote, batches))
+                    quotes = [q for batch_quotes in batch_results if batch_quotes for q in batch_quotes]
                     
                     print(f"[DEBUG] 获取到 {len(quotes)} 条行情", flush=True)
                     
-                    # 处理行情数据
+                    # 处理行情数据，根据第一条记录确定取值方式
+                    if quotes and isinstance(quotes[0], dict):
+                        get_quote = lambda x: (x.get('symbol', ''), x.get('last_done', 0) or x.get('last_price', 0))
+                    else:
+                        get_quote = lambda x: (getattr(x, 'symbol', ''),
+                                               getattr(x, 'last_done', 0) or getattr(x, 'last_price', 0))
+                    
                     for quote in quotes:
                         try:
-                            if isinstance(quote, dict):
-                                symbol = quote.get('symbol', '')
-                                last_price = float(quote.get('last_done', 0) or quote.get('last_price', 0))
-                            else:
-                                symbol = getattr(quote, 'symbol', '')
-                                last_price = float(getattr(quote, 'last_done', 0) or getattr(quote, 'last_price', 0))
+                            symbol, last_price = get_quote(quote)
+                            last_price = float(last_price)
                             
                             if symbol in position_data and last_price > 0:
                                 pos = position_data[symbol]
@@ -374,7 +684,8 @@ class DataAgent:
                                     "unrealized_pnl_ratio": unrealized_pnl_ratio
                                 })
                                 
-                                print(f"[DEBUG] {symbol}: qty={quantity}, cost={cost_price}, last={last_price}, mv={market_value:.2f}, pnl={unrealized_pnl:.2f}", flush=True)
+                                logger.debug("%s: qty=%s, cost=%s, last=%s, mv=%.2f, pnl=%.2f",
+                                             symbol, quantity, cost_price, last_price, market_value, unrealized_pnl)
                         except Exception as e:
                             print(f"[DEBUG] 处理行情失败: {e}", flush=True)
                             continue
@@ -399,6 +710,13 @@ class DataAgent:
             period: 回测周期 ('6m', '1y', '2y', '3y')
             warmup_days: 因子预热期天数（默认60天，这些数据会被丢弃）
         """
+        # 同一小时内重复请求直接使用缓存
+        cache_key = f"stockapp:quotes:{symbol}:{period}:{warmup_days}:{datetime.now(timezone.utc).strftime('%Y%m%d%H')}"
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            logger.debug("Quotes cache hit for %s, period=%s", symbol, period)
+            return cached
+        
         try:
             # 映射周期到天数（交易日约250天/年）
             period_days = {
@@ -414,39 +732,21 @@ class DataAgent:
             # 实际需要获取的数据 = 目标天数 + 预热期
             total_days_needed = target_days + warmup_days
             
-            print(f"[DEBUG] Requesting {total_days_needed} days ({target_days} effective + {warmup_days} warmup) for period={period}", flush=True)
-            
-            # 获取日K线数据
-            from longport.openapi import AdjustType, Period
-            print(f"[DEBUG] Calling candlesticks for {symbol}, count={total_days_needed}", flush=True)
-            resp = self.quote_ctx.candlesticks(symbol, Period.Day, total_days_needed, AdjustType.ForwardAdjust)
-            print(f"[DEBUG] candlesticks returned {len(resp) if resp else 0} candles", flush=True)
-            
-            data = []
-            for candle in resp:
-                data.append({
-                    "date": candle.timestamp,
-                    "open": float(candle.open),
-                    "high": float(candle.high),
-                    "low": float(candle.low),
-                    "close": float(candle.close),
-                    "volume": int(candle.volume),
-                    "amount": float(candle.turnover) if hasattr(candle, 'turnover') else 0.0
-                })
+            logger.debug("Requesting %d days (%d effective + %d warmup) for period=%s",
+                         total_days_needed, target_days, warmup_days, period)
             
-            df = pd.DataFrame(data)
-            print(f"[DEBUG] DataFrame created with {len(df)} rows", flush=True)
+            # 获取日K线数据（有缓存历史时只增量获取）
+            df = self._fetch_daily_candles(symbol, total_days_needed)
+            logger.debug("DataFrame created with %d rows", len(df))
             if not df.empty:
-                df['date'] = pd.to_datetime(df['date'])
-                df = df.sort_values('date')
-                
                 # 丢弃预热期数据（前 warmup_days 行）
                 if len(df) > warmup_days:
                     df = df.iloc[warmup_days:].reset_index(drop=True)
-                    print(f"[DEBUG] After dropping {warmup_days} warmup days: {len(df)} rows remaining", flush=True)
+                    logger.debug("After dropping %d warmup days: %d rows remaining", warmup_days, len(df))
                 else:
-                    print(f"[WARNING] Data length ({len(df)}) <= warmup_days ({warmup_days}), keeping all data", flush=True)
+                    logger.warning("Data length (%d) <= warmup_days (%d), keeping all data", len(df), warmup_days)
             
+            _cache_set(cache_key, df, QUOTES_CACHE_TTL)
             return df
         except Exception as e:
             import traceback
@@ -454,6 +754,83 @@ class DataAgent:
             print(f"堆栈跟踪: {traceback.format_exc()}")
             return pd.DataFrame()
     
+    @staticmethod
+    def _candles_to_df(resp) -> pd.DataFrame:
+        """把K线列表转换为按日期排序的DataFrame"""
+        # 按列预分配数组，单次遍历填充，避免逐行构造字典
+        n = len(resp) if resp else 0
+        dates = [None] * n
+        opens = np.empty(n, dtype=np.float64)
+        highs = np.empty(n, dtype=np.float64)
+        lows = np.empty(n, dtype=np.float64)
+        closes = np.empty(n, dtype=np.float64)
+        volumes = np.empty(n, dtype=np.int64)
+        amounts = np.zeros(n, dtype=np.float64)
+        for i, candle in enumerate(resp or []):
+            dates[i] = candle.timestamp
+            opens[i] = float(candle.open)
+            highs[i] = float(candle.high)
+            lows[i] = float(candle.low)
+            closes[i] = float(candle.close)
+            volumes[i] = int(candle.volume)
+            if hasattr(candle, 'turnover'):
+                amounts[i] = float(candle.turnover)
+        
+        df = pd.DataFrame({
+            "date": pd.to_datetime(dates),
+            "open": opens,
+            "high": highs,
+            "low": lows,
+            "close": closes,
+            "volume": volumes,
+            "amount": amounts
+        })
+        return df.sort_values('date', ignore_index=True)
+    
+    def _fetch_daily_candles(self, symbol: str, count: int) -> pd.DataFrame:
+        """获取最近 count 根前复权日K线
+        
+        Redis 中缓存了该股票足够长的历史时，只请求最新缺失的几根K线并拼接；
+        重叠K线的收盘价不一致（发生除权除息，前复权价格整体变化）时改为全量获取。
+        缓存中最后一根K线可能是盘中未走完的当日K线，收盘价本来就会变化，不参与校验（总会被新数据覆盖）
+        """
+        from longport.openapi import AdjustType, Period
+        
+        history_key = f"stockapp:quotes:{symbol}:history"
+        history = _cache_get(history_key)
+        
+        if history is not None and len(history) >= count:
+            last_date = history['date'].iloc[-1].date()
+            missing = int(np.busday_count(last_date, datetime.now().date()))
+            fetch_count = missing + QUOTES_INCREMENTAL_OVERLAP
+            if fetch_count < count:
+                logger.debug("Calling candlesticks for %s, count=%d (incremental)", symbol, fetch_count)
+                resp = self.quote_ctx.candlesticks(symbol, Period.Day, fetch_count, AdjustType.ForwardAdjust)
+                tail = self._candles_to_df(resp)
+                
+                overlap = tail['date'].isin(history['date']) & (tail['date'] != history['date'].iloc[-1])
+                if not tail.empty and overlap.any():
+                    cached_close = history.set_index('date')['close'].reindex(tail.loc[overlap, 'date']).to_numpy()
+                    if np.allclose(cached_close, tail.loc[overlap, 'close'].to_numpy()):
+                        merged = pd.concat([history[history['date'] < tail['date'].iloc[0]], tail],
+                                           ignore_index=True)
+                        # 缓存长度不超过原有历史，避免每天增长
+                        merged = merged.iloc[-len(history):].reset_index(drop=True)
+                        _cache_set(history_key, merged, QUOTES_HISTORY_TTL)
+                        return merged.iloc[-count:].reset_index(drop=True)
+                logger.debug("Cached history for %s is stale, refetching", symbol)
+                history = None
+        
+        logger.debug("Calling candlesticks for %s, count=%d", symbol, count)
+        resp = self.quote_ctx.candlesticks(symbol, Period.Day, count, AdjustType.ForwardAdjust)
+        logger.debug("candlesticks returned %d candles", len(resp) if resp else 0)
+        df = self._candles_to_df(resp)
+        
+        # 只在没有更长的有效历史时覆盖缓存
+        if history is None or len(df) >= len(history):
+            _cache_set(history_key, df, QUOTES_HISTORY_TTL)
+        return df
+    
     def get_stock_info(self, symbol: str) -> Dict:
         """获取股票基本信息"""
         try:
@@ -473,6 +850,15 @@ class DataAgent:
 
 # ============== 因子计算模块 ==============
 
+def _shortest_floats(arr: np.ndarray) -> np.ndarray:
+    """
+    float32 矩阵转为 float64 时按最短十进制表示取值（0.3 而不是 0.30000001192092896），
+    使逐元素输出的 JSON 与 orjson 直接序列化 float32 数组的结果一致
+    """
+    if arr.dtype != np.float32:
+        return arr
+    return arr.astype(str).astype(np.float64)
+
 class FactorCalculator:
     """36因子计算系统"""
     
@@ -480,13 +866,29 @@ class FactorCalculator:
         self.df = df.copy()
         self.factors = {}
         
-        # 确保价格列是 float 类型
+        # 价格和成交量保持 float64（成交量超过 2^24 时 float32 会丢失精度），只有因子矩阵降为 float32
         for col in ['open', 'high', 'low', 'close', 'volume', 'amount']:
-            if col in self.df.columns:
-                self.df[col] = self.df[col].astype(float)
+            if col in self.df.columns and self.df[col].dtype != np.float64:
+                self.df[col] = self.df[col].astype(np.float64)
+    
+    def _content_hash(self) -> str:
+        """价格数据内容哈希，用作因子缓存键"""
+        cols = [c for c in ['open', 'high', 'low', 'close', 'volume', 'amount'] if c in self.df.columns]
+        hashed = pd.util.hash_pandas_object(self.df[cols], index=False).to_numpy()
+        return hashlib.sha1(hashed.tobytes()).hexdigest()
     
     def calculate_all_factors(self) -> pd.DataFrame:
         """计算所有36个因子"""
+        # 相同价格数据的因子直接使用缓存
+        cache_key = f"stockapp:factors:{self._content_hash()}"
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            logger.debug("Factors cache hit: %s", cached.shape)
+            return cached
+        
+        # 多个因子共用的滚动统计量，只计算一次
+        self._precompute_rollings()
+        
         # 技术面因子 (12个)
         self._calc_momentum_factors()
         self._calc_volatility_factors()
@@ -502,7 +904,8 @@ class FactorCalculator:
         self._calc_chip_factors()
         
         factors_df = pd.DataFrame(self.factors)
-        print(f"[DEBUG] Factors shape: {factors_df.shape}, NA count: {factors_df.isna().sum().sum()}", flush=True)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Factors shape: %s, NA count: %d", factors_df.shape, int(factors_df.isna().to_numpy().sum()))
         
         # 对因子进行前向填充（使用前面的有效值填充NaN）
         factors_df = factors_df.ffill()
@@ -511,15 +914,63 @@ class FactorCalculator:
         # 如果还有NaN，用0填充
         factors_df = factors_df.fillna(0)
         
-        # 确保所有因子列都是 float 类型
-        for col in factors_df.columns:
-            factors_df[col] = factors_df[col].astype(float)
+        # 因子矩阵统一为 float32
+        factors_df = factors_df.astype(np.float32)
         
-        print(f"[DEBUG] After fillna: {factors_df.isna().sum().sum()} NA values", flush=True)
-        print(f"[DEBUG] Factor dtypes: {factors_df.dtypes.iloc[0]}", flush=True)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("After fillna: %d NA values, factor dtype: %s",
+                         int(factors_df.isna().to_numpy().sum()), factors_df.dtypes.iloc[0])
         
+        _cache_set(cache_key, factors_df, FACTORS_CACHE_TTL)
         return factors_df
     
+    @staticmethod
+    def to_api_payload(factors_df: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        把因子矩阵转换为列式字典 {因子名: 连续的 numpy 数组}，交给 ojsonify 直接序列化
+        （orjson 原生输出 numpy 数组，NaN/Inf 输出为 null）
+        """
+        arr = np.ascontiguousarray(factors_df.to_numpy().T)
+        return {str(col): arr[i] for i, col in enumerate(factors_df.columns)}
+    
+    @staticmethod
+    def to_api_records(factors_df: pd.DataFrame) -> List[Dict[str, Optional[float]]]:
+        """按行输出的因子记录列表（接口默认格式），NaN 转为 None"""
+        cols = [str(c) for c in factors_df.columns]
+        return [
+            {col: (None if v != v else v) for col, v in zip(cols, row)}
+            for row in _shortest_floats(factors_df.to_numpy()).tolist()
+        ]
+    
+    @staticmethod
+    def latest_values(factors_df: pd.DataFrame) -> Dict[str, Optional[float]]:
+        """最新一行因子值的字典，NaN 转为 None"""
+        row = _shortest_floats(factors_df.to_numpy()[-1:])[0].tolist()
+        return {col: (None if v != v else v) for col, v in zip(factors_df.columns, row)}
+    
+    def _precompute_rollings(self):
+        """预先计算各因子共用的收益率和滚动均值/标准差/最大值"""
+        index = self.df.index
+        close = self.df['close'].to_numpy(dtype=np.float64)
+        volume = self.df['volume'].to_numpy(dtype=np.float64)
+        
+        self.df['daily_return'] = self.df['close'].pct_change()
+        self._daily_return = self.df['daily_return']
+        
+        # 均值和标准差在同一次遍历中得到 (Numba内核)
+        _, return_std20 = rolling_mean_std(self._daily_return.to_numpy(dtype=np.float64), 20)
+        close_ma20, close_std20 = rolling_mean_std(close, 20)
+        vol_ma20, vol_std20 = rolling_mean_std(volume, 20)
+        
+        self._return_std20 = pd.Series(return_std20, index=index)
+        self._close_ma20 = pd.Series(close_ma20, index=index)
+        self._close_std20 = pd.Series(close_std20, index=index)
+        self._high20 = pd.Series(rolling_max(close, 20), index=index)
+        self._vol_ma5 = pd.Series(rolling_mean(volume, 5), index=index)
+        self._vol_ma20 = pd.Series(vol_ma20, index=index)
+        self._vol_std20 = pd.Series(vol_std20, index=index)
+        self._vol_ma60 = pd.Series(rolling_mean(volume, 60), index=index)
+    
     def _calc_momentum_factors(self):
         """计算动量因子"""
         # 5/10/20/60日动量
@@ -527,38 +978,39 @@ class FactorCalculator:
             self.factors[f'momentum_{period}d'] = self.df['close'].pct_change(period)
         
         # 上涨天数占比
-        self.df['daily_return'] = self.df['close'].pct_change()
-        self.factors['up_days_ratio'] = self.df['daily_return'].rolling(20).apply(
-            lambda x: (x > 0).sum() / len(x)
-        )
+        daily_return = self._daily_return
+        up = (daily_return > 0).astype(np.float32).where(daily_return.notna())
+        self.factors['up_days_ratio'] = up.rolling(20).mean()
     
     def _calc_volatility_factors(self):
         """计算波动率因子"""
         # 年化波动率
-        self.factors['volatility_20d'] = self.df['daily_return'].rolling(20).std() * np.sqrt(252)
+        self.factors['volatility_20d'] = self._return_std20 * np.sqrt(252)
         
         # 最大回撤
-        rolling_max = self.df['close'].cummax()
-        drawdown = (self.df['close'] - rolling_max) / rolling_max
-        self.factors['max_drawdown_60d'] = drawdown.rolling(60).min()
+        self.factors['max_drawdown_60d'] = pd.Series(
+            rolling_min_drawdown(self.df['close'].to_numpy(dtype=np.float64), 60),
+            index=self.df.index
+        )
         
-        # ATR (平均真实波幅)
-        high_low = self.df['high'] - self.df['low']
-        high_close = np.abs(self.df['high'] - self.df['close'].shift())
-        low_close = np.abs(self.df['low'] - self.df['close'].shift())
-        tr = pd.concat([high_low, high_close, low_close], axis=1).max(axis=1)
-        self.factors['atr_14'] = tr.rolling(14).mean()
+        # ATR (平均真实波幅)，fmax 与 DataFrame.max(axis=1) 一样忽略首行的 NaN
+        high = self.df['high'].to_numpy()
+        low = self.df['low'].to_numpy()
+        prev_close = self.df['close'].shift().to_numpy()
+        tr = np.fmax.reduce([high - low, np.abs(high - prev_close), np.abs(low - prev_close)])
+        self.factors['atr_14'] = pd.Series(tr, index=self.df.index).rolling(14).mean()
     
     def _calc_technical_indicators(self):
         """计算技术指标因子"""
         close = self.df['close']
         
-        # RSI
-        delta = close.diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        rs = gain / loss
-        self.factors['rsi_14'] = 100 - (100 / (1 + rs))
+        # RSI (Wilder平滑: alpha=1/14 的指数均线)
+        delta = close.diff().to_numpy()
+        gain = pd.Series(np.where(delta > 0, delta, 0.0), index=close.index)
+        loss = pd.Series(np.where(delta < 0, -delta, 0.0), index=close.index)
+        avg_gain = gain.ewm(alpha=1 / 14, adjust=False, min_periods=14).mean()
+        avg_loss = loss.ewm(alpha=1 / 14, adjust=False, min_periods=14).mean()
+        self.factors['rsi_14'] = 100 - (100 / (1 + avg_gain / avg_loss))
         
         # MACD
         exp1 = close.ewm(span=12).mean()
@@ -566,25 +1018,29 @@ class FactorCalculator:
         self.factors['macd_dif'] = exp1 - exp2
         self.factors['macd_dea'] = self.factors['macd_dif'].ewm(span=9).mean()
         
-        # 布林带宽度
-        ma20 = close.rolling(20).mean()
-        std20 = close.rolling(20).std()
-        upper_band = ma20 + 2 * std20
-        lower_band = ma20 - 2 * std20
-        self.factors['bollinger_width'] = (upper_band - lower_band) / ma20
+        # 布林带宽度: (上轨 - 下轨) / 中轨 = 4 * std20 / ma20
+        self.factors['bollinger_width'] = 4 * self._close_std20 / self._close_ma20
         
         # 成交量均线偏离
-        vol_ma20 = self.df['volume'].rolling(20).mean()
-        self.factors['volume_ma_deviation'] = self.df['volume'] / vol_ma20 - 1
-        
-        # 量价相关系数
-        self.factors['price_volume_corr'] = self.df['close'].rolling(20).corr(
-            self.df['volume']
-        )
+        self.factors['volume_ma_deviation'] = self.df['volume'] / self._vol_ma20 - 1
+        
+        # 量价相关系数: corr = (E[XY] - E[X]E[Y]) * n/(n-1) / (std(X) * std(Y))
+        # 复用缓存的20日均值/标准差，只需额外一次 close*volume 的滚动均值
+        w = 20
+        close_volume = self.df['close'].to_numpy(dtype=np.float64) * self.df['volume'].to_numpy(dtype=np.float64)
+        cov = (rolling_mean(close_volume, w) - self._close_ma20.to_numpy() * self._vol_ma20.to_numpy()) * w / (w - 1)
+        den = self._close_std20.to_numpy() * self._vol_std20.to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.where(den > 0, cov / den, np.nan)
+        self.factors['price_volume_corr'] = pd.Series(corr, index=self.df.index)
         
         # 跳空缺口频率
-        self.df['gap'] = (self.df['open'] - self.df['close'].shift()) / self.df['close'].shift()
-        self.factors['gap_frequency'] = (np.abs(self.df['gap']) > 0.01).rolling(60).mean()
+        prev_close = self.df['close'].shift().to_numpy()
+        gap = (self.df['open'].to_numpy() - prev_close) / prev_close
+        self.df['gap'] = gap
+        self.factors['gap_frequency'] = pd.Series(
+            (np.abs(gap) > 0.01).astype(np.float32), index=self.df.index
+        ).rolling(60).mean()
     
     def _calc_fundamental_factors(self):
         """计算基本面因子 (需要财务数据)"""
@@ -603,59 +1059,54 @@ class FactorCalculator:
                                        self.df['amount'].rolling(60).mean() - 1
         
         # 量能放大倍数
-        vol_ma5 = self.df['volume'].rolling(5).mean()
-        vol_ma20 = self.df['volume'].rolling(20).mean()
-        self.factors['volume_expansion'] = vol_ma5 / vol_ma20
+        vol_ma20 = self._vol_ma20
+        self.factors['volume_expansion'] = self._vol_ma5 / vol_ma20
         
         # 资金流入连续性 (简化版)
-        price_change = self.df['close'].pct_change()
         self.factors['money_flow_continuity'] = (
-            (price_change > 0) & (self.df['volume'] > self.df['volume'].rolling(20).mean())
-        ).rolling(10).mean()
+            (self._daily_return > 0) & (self.df['volume'] > vol_ma20)
+        ).astype(np.float32).rolling(10).mean()
         
         # 放量上涨概率
         self.factors['volume_price_up_prob'] = (
-            (self.df['daily_return'] > 0) & (self.df['volume'] > vol_ma20)
-        ).rolling(60).mean()
+            (self._daily_return > 0) & (self.df['volume'] > vol_ma20)
+        ).astype(np.float32).rolling(60).mean()
         
         # 高位放量回撤概率
-        high_20 = self.df['close'].rolling(20).max()
-        at_high = self.df['close'] >= high_20 * 0.98
+        at_high = self.df['close'] >= self._high20 * 0.98
         high_volume = self.df['volume'] > vol_ma20 * 1.5
         self.factors['high_volume_pullback_prob'] = (
-            at_high & high_volume & (self.df['daily_return'].shift(-1) < 0)
-        ).rolling(60).mean()
+            at_high & high_volume & (self._daily_return.shift(-1) < 0)
+        ).astype(np.float32).rolling(60).mean()
         
         # 成交集中度
-        self.factors['volume_concentration'] = self.df['volume'].rolling(20).std() / \
-                                                self.df['volume'].rolling(20).mean()
+        self.factors['volume_concentration'] = self._vol_std20 / vol_ma20
     
     def _calc_chip_factors(self):
         """计算筹码面因子"""
         # 换手率 (简化版，实际应该用流通股本计算)
-        self.factors['turnover'] = self.df['volume'] / self.df['volume'].rolling(60).mean()
+        self.factors['turnover'] = self.df['volume'] / self._vol_ma60
         
         # 换手率波动
         self.factors['turnover_volatility'] = self.factors['turnover'].rolling(20).std()
         
         # 筹码集中度 (使用价格分布估算)
-        self.factors['chip_concentration'] = self.df['close'].rolling(20).std() / \
-                                              self.df['close'].rolling(20).mean()
+        self.factors['chip_concentration'] = self._close_std20 / self._close_ma20
         
         # 高位换手
-        high_20 = self.df['close'].rolling(20).max()
         self.factors['high_turnover_at_high'] = (
-            (self.df['close'] >= high_20 * 0.98) & 
+            (self.df['close'] >= self._high20 * 0.98) & 
             (self.factors['turnover'] > 1.5)
-        ).rolling(20).mean()
+        ).astype(np.float32).rolling(20).mean()
         
         # 长期持仓稳定度
-        self.factors['holding_stability'] = 1 / (1 + self.factors['turnover_volatility'])
+        turnover_volatility = self.factors['turnover_volatility'].to_numpy()
+        self.factors['holding_stability'] = pd.Series(
+            np.reciprocal(1.0 + turnover_volatility, dtype=np.float32), index=self.df.index
+        )
         
         # 波动-换手背离
-        price_vol = self.df['daily_return'].rolling(20).std()
-        turnover_vol = self.factors['turnover'].rolling(20).std()
-        self.factors['vol_turnover_divergence'] = price_vol - turnover_vol
+        self.factors['vol_turnover_divergence'] = self._return_std20 - self.factors['turnover_volatility']
 
 # ============== 机器学习模块 ==============
 
@@ -673,7 +1124,7 @@ class MLModel:
         """准备特征和标签"""
         # 合并数据
         combined = pd.concat([df, factors_df], axis=1)
-        print(f"[DEBUG] Combined shape: {combined.shape}", flush=True)
+        logger.debug("Combined shape: %s", combined.shape)
         
         # 创建目标变量 (未来5日收益率)
         combined['target'] = combined['close'].pct_change(5).shift(-5)
@@ -682,47 +1133,92 @@ class MLModel:
         exclude_cols = ['date', 'open', 'high', 'low', 'close', 'volume', 'amount', 
                         'daily_return', 'gap', 'target']
         feature_cols = [c for c in combined.columns if c not in exclude_cols]
-        print(f"[DEBUG] Feature cols: {len(feature_cols)}", flush=True)
+        logger.debug("Feature cols: %d", len(feature_cols))
         
-        # 检查缺失值情况
-        na_before = combined.isna().sum().sum()
-        print(f"[DEBUG] Total NA values before dropna: {na_before}", flush=True)
-        print(f"[DEBUG] Rows with any NA: {combined.isna().any(axis=1).sum()}", flush=True)
+        # 检查缺失值情况（整表扫描，仅开启 DEBUG 日志时）
+        if logger.isEnabledFor(logging.DEBUG):
+            na = combined.isna().to_numpy()
+            logger.debug("Total NA values before dropna: %d, rows with any NA: %d",
+                         int(na.sum()), int(na.any(axis=1).sum()))
         
-        # 删除缺失值
-        combined_clean = combined.dropna()
-        print(f"[DEBUG] Rows after dropna: {len(combined_clean)}", flush=True)
+        # 删除缺失值（只看特征和目标列，原始价格列的缺失不影响训练）
+        combined_clean = combined.dropna(subset=feature_cols + ['target'])
+        logger.debug("Rows after dropna: %d", len(combined_clean))
         
         X = combined_clean[feature_cols]
         y = combined_clean['target']
         
         return X, y, feature_cols
     
-    def train(self, X: pd.DataFrame, y: pd.Series) -> Dict:
-        """训练模型"""
+    def train(self, X: pd.DataFrame, y: pd.Series, cache_key: Optional[str] = None) -> Dict:
+        """
+        训练模型
+        
+        Args:
+            cache_key: 模型缓存键（通常为股票代码）。LightGBM 模型按 (股票代码, 特征列, 样本量/100) 缓存
+                完整训练得到的 Booster：训练窗口相同则直接使用；新窗口只是旧窗口向后追加了不超过
+                MODEL_REFIT_MAX_NEW_ROWS 行（可丢弃开头的行）时，在它的基础上用新数据 refit 叶子值
+                （refit 结果不缓存）；其他情况以及 Booster 超过 MODEL_REFIT_MAX_AGE 后重新训练
+        """
         # 划分训练集和测试集 (时间序列划分)
         split_idx = int(len(X) * 0.8)
         X_train, X_test = X.iloc[:split_idx], X.iloc[split_idx:]
         y_train, y_test = y.iloc[:split_idx], y.iloc[split_idx:]
         
-        # 标准化
-        X_train_scaled = self.scaler.fit_transform(X_train)
-        X_test_scaled = self.scaler.transform(X_test)
+        # 标准化（仅线性模型需要，树模型按分位切分，对缩放不敏感）
+        if self.model_type == "linear":
+            X_train_scaled = self.scaler.fit_transform(X_train).astype(np.float32)
+            X_test_scaled = self.scaler.transform(X_test).astype(np.float32)
+        else:
+            X_train_scaled = X_train.to_numpy(dtype=np.float32)
+            X_test_scaled = X_test.to_numpy(dtype=np.float32)
+        
+        # 样本较少时减少树的数量
+        n_estimators = 100 if len(X) >= 500 else min(100, max(len(X) // 5, 10))
         
         # 选择模型
         if self.model_type == "linear":
             self.model = LinearRegression()
         elif self.model_type == "rf":
-            self.model = RandomForestRegressor(n_estimators=100, random_state=42)
+            self.model = RandomForestRegressor(n_estimators=n_estimators, random_state=42, n_jobs=ML_N_JOBS)
         elif self.model_type == "xgboost":
-            self.model = xgb.XGBRegressor(n_estimators=100, random_state=42)
-        elif self.model_type == "lightgbm":
-            self.model = lgb.LGBMRegressor(n_estimators=100, random_state=42)
+            self.model = xgb.XGBRegressor(n_estimators=n_estimators, random_state=42, n_jobs=ML_N_JOBS,
+                                          tree_method='hist')
         else:
-            self.model = lgb.LGBMRegressor(n_estimators=100, random_state=42)
-        
-        # 训练
-        self.model.fit(X_train_scaled, y_train)
+            self.model = lgb.LGBMRegressor(n_estimators=n_estimators, random_state=42, n_jobs=ML_N_JOBS,
+                                           verbose=-1)
+        
+        # 训练（LightGBM 命中缓存时保留树结构，只 refit 叶子值）
+        model_key = None
+        entry = None
+        if cache_key is not None and self.model_type == "lightgbm":
+            model_key = (cache_key, tuple(X.columns), len(X) // 100)
+            window_rows = _window_row_hashes(X_train_scaled, y_train)
+            with _model_cache_lock:
+                entry = _model_cache.get(model_key)
+                if entry is not None and time.time() - entry[1] < MODEL_REFIT_MAX_AGE:
+                    _model_cache.move_to_end(model_key)
+                else:
+                    entry = None
+        
+        appended = None
+        if entry is not None:
+            appended = _appended_rows(entry[2], window_rows)
+        
+        if appended == 0 and len(entry[2]) == len(window_rows):
+            # 训练窗口与完整训练时相同：结果与重新训练一致，直接使用
+            self.model = entry[0]
+        elif appended is not None and appended <= MODEL_REFIT_MAX_NEW_ROWS:
+            # 窗口只向后追加了少量新行：始终从完整训练的 Booster 出发 refit，不在 refit 结果上继续累积
+            self.model = entry[0].refit(X_train_scaled, y_train.to_numpy())
+        else:
+            self.model.fit(X_train_scaled, y_train)
+            if model_key is not None:
+                with _model_cache_lock:
+                    _model_cache[model_key] = (self.model.booster_, time.time(), window_rows)
+                    _model_cache.move_to_end(model_key)
+                    while len(_model_cache) > MODEL_CACHE_SIZE:
+                        _model_cache.popitem(last=False)
         
         # 预测
         y_pred_train = np.array(self.model.predict(X_train_scaled), dtype=np.float64)
@@ -767,9 +1263,12 @@ class MLModel:
         
         # 特征重要性
         self.feature_importance = {}
-        if hasattr(self.model, 'feature_importances_'):
+        if hasattr(self.model, 'feature_importances_') or isinstance(self.model, lgb.Booster):
             try:
-                importances = self.model.feature_importances_
+                if isinstance(self.model, lgb.Booster):
+                    importances = self.model.feature_importance()
+                else:
+                    importances = self.model.feature_importances_
                 if importances is not None and hasattr(importances, '__len__'):
                     self.feature_importance = {str(k): float(v) for k, v in zip(X.columns, importances)}
                     print(f"[DEBUG] Feature importance calculated: {len(self.feature_importance)} features", flush=True)
@@ -782,78 +1281,103 @@ class MLModel:
     
     def predict(self, X: pd.DataFrame) -> np.ndarray:
         """预测"""
-        X_scaled = self.scaler.transform(X)
+        if self.model_type == "linear":
+            X_scaled = self.scaler.transform(X).astype(np.float32)
+        else:
+            X_scaled = X.to_numpy(dtype=np.float32)
         return self.model.predict(X_scaled)
 
+# LightGBM Booster 缓存：(股票代码, 特征列, 样本量/100) -> (完整训练的 Booster, 训练时间, 训练窗口逐行哈希)，
+# 按最近使用顺序淘汰
+MODEL_CACHE_SIZE = 64
+MODEL_REFIT_MAX_AGE = int(os.environ.get('MODEL_REFIT_MAX_AGE', str(24 * 3600)))  # 超过后重新生长树
+MODEL_REFIT_MAX_NEW_ROWS = 20  # 训练窗口追加超过该行数时重新训练
+_model_cache: "OrderedDict[Tuple, Tuple[lgb.Booster, float, np.ndarray]]" = OrderedDict()
+_model_cache_lock = threading.Lock()
+
+def _window_row_hashes(X_train: np.ndarray, y_train: pd.Series) -> np.ndarray:
+    """训练窗口（特征 + 标签）的逐行哈希，用于判断新窗口与缓存窗口的关系"""
+    rows = pd.DataFrame(X_train)
+    rows['target'] = y_train.to_numpy(dtype=np.float64)
+    return pd.util.hash_pandas_object(rows, index=False).to_numpy()
+
+def _appended_rows(old_rows: np.ndarray, new_rows: np.ndarray) -> Optional[int]:
+    """
+    新窗口是旧窗口（可丢弃开头若干行）再追加若干行时返回追加的行数，否则返回 None；
+    此时 Booster 的训练数据不晚于新窗口的最后一行，refit 不会引入未来数据
+    """
+    if len(old_rows) == 0 or len(new_rows) == 0:
+        return None
+    starts = np.flatnonzero(old_rows == new_rows[0])
+    if len(starts) == 0:
+        return None
+    kept = old_rows[starts[0]:]
+    if len(kept) > len(new_rows) or not np.array_equal(kept, new_rows[:len(kept)]):
+        return None
+    return len(new_rows) - len(kept)
+
 # ============== 回测模块 ==============
 
 class Backtester:
     """回测系统"""
     
     def __init__(self, df: pd.DataFrame, factors_df: pd.DataFrame):
-        self.df = df.copy()
-        self.factors_df = factors_df.copy()
+        # 只读使用，run_backtest 中 concat 生成新的 DataFrame，不需要复制
+        self.df = df
+        self.factors_df = factors_df
         self.results = {}
     
-    def run_backtest(self, signal_col: str, top_n: int = 5) -> Dict:
-        """运行回测"""
+    def run_backtest(self, signal_col: str, top_n: int = 5, include_curve: bool = True) -> Dict:
+        """
+        运行回测
+        
+        Args:
+            signal_col: 用作信号的因子列
+            include_curve: 是否返回累计净值曲线（最多 BACKTEST_CURVE_MAX_POINTS 个点）
+        """
         # 合并数据
         combined = pd.concat([self.df, self.factors_df], axis=1)
-        print(f"[DEBUG] Backtest combined shape: {combined.shape}", flush=True)
-        print(f"[DEBUG] Backtest NA count: {combined.isna().sum().sum()}", flush=True)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Backtest combined shape: %s", combined.shape)
+            logger.debug("Backtest NA count: %d", int(combined.isna().to_numpy().sum()))
         
         # 确保 close 列是 float 类型
         combined['close'] = combined['close'].astype(float)
         
         combined = combined.dropna()
-        print(f"[DEBUG] Backtest after dropna: {len(combined)}", flush=True)
+        logger.debug("Backtest after dropna: %d", len(combined))
         
         if len(combined) == 0:
             return {"error": "无有效数据"}
         
-        # 生成信号 (基于因子排名)
-        combined['signal'] = combined[signal_col].rank(pct=True)
-        combined['position'] = np.where(combined['signal'] > 0.8, 1,  # 做多
-                                       np.where(combined['signal'] < 0.2, -1, 0))  # 做空
+        # 生成信号 (基于因子排名，与 rank(pct=True) 一致)
+        signal = rankdata(combined[signal_col].to_numpy(dtype=np.float64)) / len(combined)
+        position = np.select([signal > 0.8, signal < 0.2], [1.0, -1.0], 0.0)  # 做多 / 做空
         
-        # 计算收益
-        combined['daily_return'] = combined['close'].pct_change()
-        combined['strategy_return'] = combined['position'].shift(1) * combined['daily_return']
-        
-        # 累计收益
-        combined['cumulative_market'] = (1 + combined['daily_return']).cumprod()
-        combined['cumulative_strategy'] = (1 + combined['strategy_return']).cumprod()
+        # 收益、累计净值、回撤、波动率、胜率在同一次遍历中计算 (Numba内核)
+        close = combined['close'].to_numpy(dtype=np.float64)
+        (cum_market, cum_strategy, max_drawdown,
+         return_std, n_wins, n_trades) = backtest_kernel(close, position)
         
         # 计算指标
-        returns = combined['strategy_return'].dropna()
+        n_returns = len(close) - 1
         
-        if len(returns) == 0 or returns.std() == 0:
+        if n_returns == 0 or return_std == 0:
             return {"error": "策略无有效收益"}
         
         # 年化收益
-        total_return = combined['cumulative_strategy'].iloc[-1] - 1
+        total_return = cum_strategy[-1] - 1
         n_days = len(combined)
         annual_return = (1 + total_return) ** (252 / n_days) - 1
         
         # 年化波动率
-        annual_volatility = returns.std() * np.sqrt(252)
+        annual_volatility = return_std * np.sqrt(252)
         
         # 夏普比率 (假设无风险利率2%)
         sharpe_ratio = (annual_return - 0.02) / annual_volatility if annual_volatility > 0 else 0
         
-        # 最大回撤
-        cummax = combined['cumulative_strategy'].cummax()
-        drawdown = (combined['cumulative_strategy'] - cummax) / cummax
-        max_drawdown = drawdown.min()
-        
         # 胜率
-        win_rate = (returns > 0).sum() / len(returns)
-        
-        # 转换累计收益数据为原生类型
-        cum_returns = combined[['date', 'cumulative_market', 'cumulative_strategy']].copy()
-        cum_returns['date'] = cum_returns['date'].astype(str)
-        cum_returns['cumulative_market'] = cum_returns['cumulative_market'].astype(float)
-        cum_returns['cumulative_strategy'] = cum_returns['cumulative_strategy'].astype(float)
+        win_rate = n_wins / n_returns
         
         self.results = {
             "total_return": float(round(total_return * 100, 2)),
@@ -862,10 +1386,26 @@ class Backtester:
             "sharpe_ratio": float(round(sharpe_ratio, 2)),
             "max_drawdown": float(round(max_drawdown * 100, 2)),
             "win_rate": float(round(win_rate * 100, 2)),
-            "n_trades": int(len(returns[returns != 0])),
-            "cumulative_returns": cum_returns.to_dict('records')
+            "n_trades": int(n_trades),
         }
         
+        if include_curve:
+            # 累计净值曲线：点数过多时均匀抽样（保留首尾），图表不需要逐日数据
+            if n_days > BACKTEST_CURVE_MAX_POINTS:
+                idx = np.unique(np.linspace(0, n_days - 1, BACKTEST_CURVE_MAX_POINTS).round().astype(np.int64))
+            else:
+                idx = slice(None)
+            # 转换为原生类型（日期整列格式化一次，再逐行组装）
+            dates = combined['date'].iloc[idx]
+            if pd.api.types.is_datetime64_any_dtype(dates):
+                date_strs = dates.dt.strftime('%Y-%m-%d').tolist()
+            else:
+                date_strs = dates.astype(str).tolist()
+            self.results["cumulative_returns"] = [
+                {"date": d, "cumulative_market": m, "cumulative_strategy": c}
+                for d, m, c in zip(date_strs, cum_market[idx].tolist(), cum_strategy[idx].tolist())
+            ]
+        
         return self.results
 
 # ============== 投资组合优化 ==============
@@ -876,17 +1416,49 @@ class PortfolioOptimizer:
     def __init__(self, returns_df: pd.DataFrame):
         self.returns = returns_df
         self.optimal_weights = None
+        self._moments = None
+    
+    def _annualized_moments(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        年化预期收益和协方差矩阵（首次计算后缓存）
+        
+        协方差用 X'X/(N-1) - N/(N-1)·μ'μ 计算，一次矩阵乘法得到，
+        不需要生成去均值后的 N×p 副本；只使用各资产都有数据的交易日
+        """
+        if self._moments is None:
+            X = self.returns.dropna().to_numpy(dtype=np.float64)
+            n_obs = X.shape[0]
+            mu = X.mean(axis=0, keepdims=True)
+            cov = (X.T @ X) / (n_obs - 1) - (n_obs / (n_obs - 1)) * (mu.T @ mu)
+            self._moments = (mu.ravel() * 252, cov * 252)
+        return self._moments
     
     def mean_variance_optimization(self, target_return: Optional[float] = None) -> Dict:
         """均值-方差优化"""
         n_assets = len(self.returns.columns)
         
         # 预期收益和协方差
-        expected_returns = self.returns.mean() * 252
-        cov_matrix = self.returns.cov() * 252
+        expected_returns, cov_matrix = self._annualized_moments()
         
-        # 简单等权作为基准
-        weights = np.array([1/n_assets] * n_assets)
+        # Cholesky 分解协方差矩阵（加小岭项保证正定）
+        chol = cho_factor(cov_matrix + 1e-6 * np.eye(n_assets))
+        ones = np.ones(n_assets)
+        inv_ones = cho_solve(chol, ones)
+        
+        if target_return is None:
+            # 最小方差组合: w = Σ⁻¹1 / (1'Σ⁻¹1)
+            weights = inv_ones / inv_ones.sum()
+        else:
+            # 给定目标收益的有效组合（两基金定理）: w = Σ⁻¹(λ1 + γμ)
+            inv_mu = cho_solve(chol, expected_returns)
+            a = ones @ inv_ones
+            b = ones @ inv_mu
+            c = expected_returns @ inv_mu
+            d = a * c - b * b
+            lam = (c - b * target_return) / d
+            gamma = (a * target_return - b) / d
+            weights = lam * inv_ones + gamma * inv_mu
+        self.optimal_weights = weights
         
         portfolio_return = np.dot(weights, expected_returns)
         portfolio_volatility = np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights)))
@@ -899,13 +1471,37 @@ class PortfolioOptimizer:
             "sharpe_ratio": round(sharpe, 2)
         }
     
-    def risk_parity(self) -> Dict:
-        """风险平价"""
-        n_assets = len(self.returns.columns)
-        weights = np.array([1/n_assets] * n_assets)
+    def risk_parity(self, max_iter: int = 50, tol: float = 1e-10) -> Dict:
+        """
+        风险平价（等风险贡献, ERC）
+        
+        求解凸问题 min ½y'Σy - Σlog(y_i) 的牛顿迭代，最优解满足 y_i·(Σy)_i = 1，
+        归一化后各资产风险贡献相等；以逆波动率权重作为初值
+        """
+        _, cov_matrix = self._annualized_moments()
+        
+        # 逆波动率初值
+        y = 1 / np.sqrt(np.diag(cov_matrix))
+        y /= np.sqrt(y @ cov_matrix @ y)
+        
+        for _ in range(max_iter):
+            grad = cov_matrix @ y - 1 / y
+            if np.abs(grad).max() < tol:
+                break
+            step = np.linalg.solve(cov_matrix + np.diag(1 / (y * y)), grad)
+            # 回溯保证权重为正
+            t = 1.0
+            while np.any(y - t * step <= 0):
+                t *= 0.5
+            y = y - t * step
+        
+        weights = y / y.sum()
+        self.optimal_weights = weights
+        portfolio_volatility = np.sqrt(weights @ cov_matrix @ weights)
         
         return {
             "weights": dict(zip(self.returns.columns, weights)),
+            "expected_volatility": round(portfolio_volatility * 100, 2),
             "method": "risk_parity"
         }
 
@@ -1010,6 +1606,7 @@ def bind_longport_credentials():
     result = auth_service.bind_longport_credentials(
         user_id, api_key, api_secret, access_token
     )
+    invalidate_user_config(user_id)
     return jsonify(result)
 
 @app.route('/api/auth/longport/connect', methods=['POST'])
@@ -1074,7 +1671,7 @@ def get_holdings():
         return jsonify({"error": error}), 400
     
     try:
-        agent = DataAgent(config)
+        agent = get_agent(user_id, config)
         holdings = agent.get_holdings()
         return jsonify({"holdings": holdings})
     except Exception as e:
@@ -1092,7 +1689,7 @@ def get_watchlist():
         return jsonify({"error": error}), 400
     
     try:
-        agent = DataAgent(config)
+        agent = get_agent(user_id, config)
         watchlist = agent.get_watchlist()
         return jsonify({"watchlist": watchlist})
     except Exception as e:
@@ -1114,7 +1711,7 @@ def get_historical():
     period = data.get('period', '3y')
     
     try:
-        agent = DataAgent(config)
+        agent = get_agent(user_id, config)
         df = agent.get_historical_quotes(symbol, period)
         
         if df.empty:
@@ -1148,42 +1745,149 @@ def calculate_factors():
         calculator = FactorCalculator(df)
         factors_df = calculator.calculate_all_factors()
         
-        return jsonify({
+        # 默认仍返回按行的记录列表；?format=columnar 时返回 {因子名: 数组} 的列式结构
+        if request.args.get('format') == 'columnar':
+            factors = calculator.to_api_payload(factors_df)
+        else:
+            factors = calculator.to_api_records(factors_df)
+        
+        return ojsonify({
             "factors_count": len(factors_df.columns),
             "factor_names": list(factors_df.columns),
-            "factors": factors_df.replace({np.nan: None}).to_dict('records')
+            "factors": factors
         })
     except Exception as e:
         return jsonify({"error": str(e), "trace": traceback.format_exc()})
 
+# ============== 模型训练任务队列 ==============
+
+# /api/ml/train 默认同步返回训练结果；?async=1（或请求体 "async": true）时提交到后台线程池，
+# 立即返回 task_id，客户端轮询 /api/ml/status/<task_id>。
+# 任务状态在 Redis 可用时写入 Redis（多个 gunicorn worker 共享），否则保存在进程内
+TRAIN_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get('TRAIN_WORKERS', '4')))
+TRAIN_TASK_TTL = 3600  # 已完成任务的结果保留1小时
+TRAIN_TASK_MAX = 1000  # 进程内最多保留的任务数，超出时淘汰最早完成的任务
+_train_tasks: "OrderedDict[str, Tuple[Future, List[float]]]" = OrderedDict()  # task_id -> (Future, [完成时间])
+_train_tasks_lock = threading.Lock()
+
+def _do_train(price_data: List[Dict], factors_data: List[Dict], model_type: str) -> Dict:
+    """训练模型并返回结果"""
+    df = pd.DataFrame(price_data)
+    factors_df = pd.DataFrame(factors_data)
+    
+    ml = MLModel(model_type)
+    X, y, feature_cols = ml.prepare_features(df, factors_df)
+    
+    if len(X) < 100:
+        return {"error": "数据量不足，需要至少100条记录"}
+    
+    metrics = ml.train(X, y)
+    
+    return {
+        "model_type": model_type,
+        "metrics": metrics,
+        "feature_importance": ml.feature_importance,
+        "feature_count": len(feature_cols)
+    }
+
+def _train_task_key(task_id: str) -> str:
+    return f"stockapp:mltask:{task_id}"
+
+def _save_train_task(task_id: str, state: Dict):
+    """把任务状态写入 Redis（Redis 不可用时不做任何事）"""
+    if redis_client is None:
+        return
+    try:
+        redis_client.setex(_train_task_key(task_id), TRAIN_TASK_TTL,
+                           json.dumps(convert_to_native({"task_id": task_id, **state})))
+    except Exception as e:
+        print(f"[WARNING] 写入训练任务状态失败 {task_id}: {e}", flush=True)
+
+def _run_train_task(task_id: str, price_data: List[Dict], factors_data: List[Dict], model_type: str) -> Dict:
+    """后台执行训练并记录状态"""
+    _save_train_task(task_id, {"status": "running"})
+    try:
+        result = _do_train(price_data, factors_data, model_type)
+    except Exception as e:
+        trace = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+        _save_train_task(task_id, {"status": "failed", "error": str(e), "trace": trace})
+        raise
+    _save_train_task(task_id, {"status": "done", "result": result})
+    return result
+
+def _prune_train_tasks():
+    """淘汰完成超过保留时间的任务；任务数超过上限时再淘汰最早完成的任务"""
+    now = time.time()
+    with _train_tasks_lock:
+        finished = [(tid, entry[1][0]) for tid, entry in _train_tasks.items() if entry[1]]
+        for tid, finished_at in finished:
+            if now - finished_at >= TRAIN_TASK_TTL:
+                del _train_tasks[tid]
+        overflow = len(_train_tasks) - TRAIN_TASK_MAX
+        for tid, _ in sorted(finished, key=lambda item: item[1]):
+            if overflow <= 0:
+                break
+            if tid in _train_tasks:
+                del _train_tasks[tid]
+                overflow -= 1
+
 @app.route('/api/ml/train', methods=['POST'])
 def train_model():
-    """训练机器学习模型"""
+    """训练机器学习模型（?async=1 时提交后台任务并返回 task_id）"""
     data = request.json
     factors_data = data.get('factors_data', [])
     price_data = data.get('price_data', [])
     model_type = data.get('model_type', 'lightgbm')
+    run_async = request.args.get('async', '').lower() in ('1', 'true', 'yes') or data.get('async') is True
+    
+    if not run_async:
+        try:
+            result = _do_train(price_data, factors_data, model_type)
+        except Exception as e:
+            return jsonify({"error": str(e), "trace": traceback.format_exc()})
+        return ojsonify(result)
+    
+    _prune_train_tasks()
+    task_id = uuid.uuid4().hex
+    _save_train_task(task_id, {"status": "pending"})
+    future = TRAIN_POOL.submit(_run_train_task, task_id, price_data, factors_data, model_type)
+    finished_at: List[float] = []
+    future.add_done_callback(lambda _: finished_at.append(time.time()))
+    with _train_tasks_lock:
+        _train_tasks[task_id] = (future, finished_at)
+    
+    return jsonify({"task_id": task_id, "status": "pending"})
+
+@app.route('/api/ml/status/<task_id>', methods=['GET'])
+def train_status(task_id):
+    """查询异步训练任务状态，完成后返回训练结果"""
+    _prune_train_tasks()
+    with _train_tasks_lock:
+        task = _train_tasks.get(task_id)
+    
+    if task is None:
+        # 任务可能由其他 worker 提交，从 Redis 读取
+        state = None
+        if redis_client is not None:
+            try:
+                state = redis_client.get(_train_task_key(task_id))
+            except Exception as e:
+                print(f"[WARNING] 读取训练任务状态失败 {task_id}: {e}", flush=True)
+        if state is None:
+            return jsonify({"error": "任务不存在或已过期"}), 404
+        return Response(state, mimetype='application/json')
+    
+    future = task[0]
+    if not future.done():
+        return jsonify({"task_id": task_id, "status": "running" if future.running() else "pending"})
     
     try:
-        df = pd.DataFrame(price_data)
-        factors_df = pd.DataFrame(factors_data)
-        
-        ml = MLModel(model_type)
-        X, y, feature_cols = ml.prepare_features(df, factors_df)
-        
-        if len(X) < 100:
-            return jsonify({"error": "数据量不足，需要至少100条记录"})
-        
-        metrics = ml.train(X, y)
-        
-        return jsonify({
-            "model_type": model_type,
-            "metrics": metrics,
-            "feature_importance": ml.feature_importance,
-            "feature_count": len(feature_cols)
-        })
+        result = future.result()
     except Exception as e:
-        return jsonify({"error": str(e), "trace": traceback.format_exc()})
+        trace = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+        return jsonify({"task_id": task_id, "status": "failed", "error": str(e), "trace": trace})
+    
+    return ojsonify({"task_id": task_id, "status": "done", "result": result})
 
 @app.route('/api/backtest/run', methods=['POST'])
 def run_backtest():
@@ -1192,13 +1896,14 @@ def run_backtest():
     price_data = data.get('price_data', [])
     factors_data = data.get('factors_data', [])
     signal_col = data.get('signal_col', 'momentum_20d')
+    include_curve = data.get('include_curve', True)
     
     try:
         df = pd.DataFrame(price_data)
         factors_df = pd.DataFrame(factors_data)
         
         backtester = Backtester(df, factors_df)
-        results = backtester.run_backtest(signal_col)
+        results = backtester.run_backtest(signal_col, include_curve=include_curve)
         
         return jsonify(results)
     except Exception as e:
@@ -1216,7 +1921,7 @@ def optimize_portfolio():
         optimizer = PortfolioOptimizer(returns_df)
         
         if method == 'mean_variance':
-            result = optimizer.mean_variance_optimization()
+            result = optimizer.mean_variance_optimization(data.get('target_return'))
         else:
             result = optimizer.risk_parity()
         
@@ -1242,12 +1947,13 @@ def comprehensive_analysis():
     data = request.json
     symbol = data.get('symbol')
     period = data.get('period', '3y')  # 默认3年
+    include_curve = data.get('include_curve', True)  # 前端回测页需要累计净值曲线
     print(f"[API] user_id={user_id}, symbol={symbol}, period={period}", flush=True)
     
     try:
         # 1. 获取数据
         print(f"[API] Creating DataAgent...", flush=True)
-        agent = DataAgent(config)
+        agent = get_agent(user_id, config)
         print(f"[API] Getting historical quotes for {symbol}, period={period}...", flush=True)
         df = agent.get_historical_quotes(symbol, period)
         print(f"[API] Got {len(df)} rows of data", flush=True)
@@ -1271,7 +1977,7 @@ def comprehensive_analysis():
         
         model_metrics = {}
         if len(X) >= 100:
-            model_metrics = ml.train(X, y)
+            model_metrics = ml.train(X, y, cache_key=symbol)
             print(f"[API] ML model trained, metrics: {list(model_metrics.keys())}", flush=True)
         else:
             print(f"[API] ML skipped: only {len(X)} samples (need >= 100)", flush=True)
@@ -1279,30 +1985,25 @@ def comprehensive_analysis():
         # 4. 回测
         print(f"[API] Running backtest...", flush=True)
         backtester = Backtester(df, factors_df)
-        backtest_results = backtester.run_backtest('momentum_20d')
+        backtest_results = backtester.run_backtest('momentum_20d', include_curve=include_curve)
         print(f"[API] Backtest completed: {list(backtest_results.keys()) if 'error' not in backtest_results else backtest_results}", flush=True)
         
         # 5. 最新信号
-        latest_factors = factors_df.iloc[-1].replace({np.nan: None}).to_dict()
+        latest_factors = FactorCalculator.latest_values(factors_df)
         latest_price = float(df.iloc[-1]['close'])
         
         # 检查数据类型
         print(f"[DEBUG] model_metrics types: {[(k, type(v).__name__) for k, v in model_metrics.items()]}", flush=True)
         print(f"[DEBUG] latest_factors sample types: {[(k, type(v).__name__) for k, v in list(latest_factors.items())[:5]]}", flush=True)
         
-        # 构建结果 - 先转换每个部分
-        converted_latest_factors = convert_to_native(latest_factors)
-        converted_model_metrics = convert_to_native(model_metrics)
-        converted_backtest_results = convert_to_native(backtest_results)
-        
         result = {
             "symbol": symbol,
             "analysis_date": datetime.now().isoformat(),
             "data_points": int(len(df)),
             "latest_price": float(latest_price),
-            "latest_factors": converted_latest_factors,
-            "model_metrics": converted_model_metrics,
-            "backtest_results": converted_backtest_results,
+            "latest_factors": latest_factors,
+            "model_metrics": model_metrics,
+            "backtest_results": backtest_results,
             "summary": {
                 "trend_signal": "bullish" if latest_factors.get('momentum_20d', 0) > 0 else "bearish",
                 "volatility_level": "high" if latest_factors.get('volatility_20d', 0) > 0.3 else "normal",
@@ -1313,13 +2014,88 @@ def comprehensive_analysis():
         
         print(f"[DEBUG] Result test_r2 type: {type(result['model_metrics'].get('test_r2')).__name__}", flush=True)
         
-        return jsonify(result)
+        return ojsonify(result)
     except Exception as e:
         import traceback
         print(f"[API] ERROR: {e}", flush=True)
         traceback.print_exc()
         return jsonify({"error": str(e), "trace": traceback.format_exc()})
 
+# 综合评分规则：[momentum_20d, momentum_5d, rsi_14, macd_dif] 高于阈值时加对应分数
+_TREND_KEYS = ('momentum_20d', 'momentum_5d', 'rsi_14', 'macd_dif')
+_TREND_DEFAULTS = np.array([0, 0, 50, 0], dtype=np.float64)
+_TREND_THRESHOLDS = np.array([0, 0, 50, 0], dtype=np.float64)
+_TREND_WEIGHTS = np.array([20, 15, 10, 5])
+# 风险评分规则：对 [-volatility_20d, max_drawdown_60d]，高于上阈值加分、低于下阈值减分
+_RISK_KEYS = ('volatility_20d', 'max_drawdown_60d')
+_RISK_DEFAULTS = np.array([0.2, 0], dtype=np.float64)
+_RISK_SIGNS = np.array([-1, 1], dtype=np.float64)
+_RISK_UPPER = np.array([-0.2, -0.1])
+_RISK_LOWER = np.array([-0.4, -0.2])
+_RISK_WEIGHTS = np.array([20, 15])
+
+def _factor_vector(latest_factors: Dict, keys: Tuple[str, ...], defaults: np.ndarray) -> np.ndarray:
+    """按 keys 取出因子值组成数组，缺失时用默认值，None 视为 NaN（不满足任何阈值）"""
+    values = np.array([latest_factors.get(k, np.nan) for k in keys], dtype=np.float64)
+    missing = np.array([k not in latest_factors for k in keys])
+    return np.where(missing, defaults, values)
+
+def _score_factors(latest_factors: Dict) -> Tuple[int, int]:
+    """根据最新因子值计算 (趋势评分, 风险评分)，基准均为50"""
+    trend = _factor_vector(latest_factors, _TREND_KEYS, _TREND_DEFAULTS)
+    trend_score = 50 + int((trend > _TREND_THRESHOLDS) @ _TREND_WEIGHTS)
+
+    risk = _factor_vector(latest_factors, _RISK_KEYS, _RISK_DEFAULTS) * _RISK_SIGNS
+    risk_flags = (risk > _RISK_UPPER).astype(np.int64) - (risk < _RISK_LOWER)
+    risk_score = 50 + int(risk_flags @ _RISK_WEIGHTS)
+    return trend_score, risk_score
+
+def _analyze_one(symbol: str, agent: 'DataAgent', period: str, include_curve: bool = False) -> Dict:
+    """分析单只股票：获取数据 → 因子 → 回测 → 模型 → 评分"""
+    print(f"[API] Analyzing {symbol}...", flush=True)
+
+    # 1. 获取历史数据
+    df = agent.get_historical_quotes(symbol, period)
+    if df.empty:
+        raise ValueError("无法获取数据")
+
+    # 2. 计算因子
+    calculator = FactorCalculator(df)
+    factors_df = calculator.calculate_all_factors()
+
+    # 3. 获取最新因子值
+    latest_factors = FactorCalculator.latest_values(factors_df)
+
+    # 4. 回测（使用20日动量作为信号）
+    backtester = Backtester(df, factors_df)
+    backtest_results = backtester.run_backtest('momentum_20d', include_curve=include_curve)
+
+    # 5. 训练模型（数据足够时）
+    model_metrics = {}
+    if len(df) >= 100:
+        try:
+            ml = MLModel('lightgbm')
+            X, y, feature_cols = ml.prepare_features(df, factors_df)
+            if len(X) >= 100:
+                model_metrics = ml.train(X, y, cache_key=symbol)
+        except Exception as e:
+            print(f"[API] Model training failed for {symbol}: {e}", flush=True)
+
+    # 6. 计算综合评分 / 7. 风险评分
+    trend_score, risk_score = _score_factors(latest_factors)
+
+    return {
+        "symbol": symbol,
+        "latest_price": float(df.iloc[-1]['close']),
+        "data_points": len(df),
+        "trend_score": round(trend_score, 1),
+        "risk_score": round(risk_score, 1),
+        "composite_score": round((trend_score + risk_score) / 2, 1),
+        "latest_factors": latest_factors,
+        "backtest": backtest_results,
+        "model_metrics": model_metrics
+    }
+
 @app.route('/api/portfolio/analyze', methods=['POST'])
 def analyze_portfolio():
     """批量分析持仓/关注列表股票"""
@@ -1336,96 +2112,40 @@ def analyze_portfolio():
     data = request.json
     symbols = data.get('symbols', [])
     period = data.get('period', '1y')
+    include_curve = data.get('include_curve', False)  # 批量分析默认不返回净值曲线
     
     print(f"[API] user_id={user_id}, symbols_count={len(symbols)}, period={period}", flush=True)
     
     if not symbols:
         return jsonify({"error": "股票列表为空"})
     
-    results = []
     errors = []
     
     try:
-        agent = DataAgent(config)
+        agent = get_agent(user_id, config)
         
         # 最多分析10只股票
         symbols_to_analyze = symbols[:10]
         
-        for symbol in symbols_to_analyze:
-            try:
-                print(f"[API] Analyzing {symbol}...", flush=True)
-                
-                # 1. 获取历史数据
-                df = agent.get_historical_quotes(symbol, period)
-                if df.empty:
-                    errors.append({"symbol": symbol, "error": "无法获取数据"})
-                    continue
-                
-                # 2. 计算因子
-                calculator = FactorCalculator(df)
-                factors_df = calculator.calculate_all_factors()
-                
-                # 3. 获取最新因子值
-                latest_factors = factors_df.iloc[-1].replace({np.nan: None}).to_dict()
-                
-                # 4. 回测（使用20日动量作为信号）
-                backtester = Backtester(df, factors_df)
-                backtest_results = backtester.run_backtest('momentum_20d')
-                
-                # 5. 训练模型（数据足够时）
-                model_metrics = {}
-                if len(df) >= 100:
-                    try:
-                        ml = MLModel('lightgbm')
-                        X, y, feature_cols = ml.prepare_features(df, factors_df)
-                        if len(X) >= 100:
-                            model_metrics = ml.train(X, y)
-                    except Exception as e:
-                        print(f"[API] Model training failed for {symbol}: {e}", flush=True)
-                
-                # 6. 计算综合评分
-                trend_score = 50
-                if latest_factors.get('momentum_20d', 0) > 0:
-                    trend_score += 20
-                if latest_factors.get('momentum_5d', 0) > 0:
-                    trend_score += 15
-                if latest_factors.get('rsi_14', 50) > 50:
-                    trend_score += 10
-                if latest_factors.get('macd_dif', 0) > 0:
-                    trend_score += 5
-                
-                # 7. 风险评分
-                risk_score = 50
-                if latest_factors.get('volatility_20d', 0.2) < 0.2:
-                    risk_score += 20
-                elif latest_factors.get('volatility_20d', 0.2) > 0.4:
-                    risk_score -= 20
-                    
-                if latest_factors.get('max_drawdown_60d', 0) > -0.1:
-                    risk_score += 15
-                elif latest_factors.get('max_drawdown_60d', 0) < -0.2:
-                    risk_score -= 15
-                
-                results.append({
-                    "symbol": symbol,
-                    "latest_price": float(df.iloc[-1]['close']),
-                    "data_points": len(df),
-                    "trend_score": round(trend_score, 1),
-                    "risk_score": round(risk_score, 1),
-                    "composite_score": round((trend_score + risk_score) / 2, 1),
-                    "latest_factors": convert_to_native(latest_factors),
-                    "backtest": convert_to_native(backtest_results),
-                    "model_metrics": convert_to_native(model_metrics)
-                })
-                
-            except Exception as e:
-                print(f"[API] Error analyzing {symbol}: {e}", flush=True)
-                errors.append({"symbol": symbol, "error": str(e)})
+        # 各股票之间互不依赖，线程池并发执行（网络I/O和numpy/LightGBM计算都会释放GIL）
+        with ThreadPoolExecutor(max_workers=min(10, len(symbols_to_analyze))) as executor:
+            futures = {executor.submit(_analyze_one, symbol, agent, period, include_curve): (i, symbol)
+                       for i, symbol in enumerate(symbols_to_analyze)}
+            indexed_results = []
+            for future in as_completed(futures):
+                i, symbol = futures[future]
+                try:
+                    indexed_results.append((i, future.result()))
+                except Exception as e:
+                    print(f"[API] Error analyzing {symbol}: {e}", flush=True)
+                    errors.append({"symbol": symbol, "error": str(e)})
         
-        # 按综合评分排序
+        # 恢复请求顺序后按综合评分排序（同分时保持原顺序）
+        indexed_results.sort(key=lambda x: x[0])
+        results = [result for _, result in indexed_results]
         results.sort(key=lambda x: x.get('composite_score', 0), reverse=True)
         
-        return jsonify({
+        return ojsonify({
             "results": results,
             "errors": errors,
             "total_analyzed": len(results),
@@ -1461,7 +2181,7 @@ def get_chart_candles():
     try:
         from longport.openapi import AdjustType, Period
         
-        agent = DataAgent(config)
+        agent = get_agent(user_id, config)
         
         # 计算需要的K线数量
         # 日K：250个交易日/年
@@ -1562,6 +2282,12 @@ def get_chart_candles():
         traceback.print_exc()
         return jsonify({"error": str(e), "trace": traceback.format_exc()})
 
+# 美股交易时段分界（当日分钟数）：04:00 / 09:30 / 16:00 / 20:00
+_SESSION_NAMES = ['PreMarket', 'Regular', 'AfterHours', 'Night']
+_US_SESSION_EDGES = np.array([4 * 60, 9 * 60 + 30, 16 * 60, 20 * 60])
+# 分桶结果 -> 时段编码：[夜盘, 盘前, 盘中, 盘后, 夜盘]
+_US_SESSION_CODES = np.array([3, 0, 1, 2, 3], dtype=np.uint8)
+
 @app.route('/api/chart/intraday', methods=['POST'])
 def get_intraday_data():
     """获取当日/指定日期分时数据 - 支持盘前/盘中/盘后/夜盘"""
@@ -1583,9 +2309,9 @@ def get_intraday_data():
     
     try:
         from longport.openapi import AdjustType, Period
-        from datetime import datetime, timedelta, time as dt_time
+        from datetime import datetime, timedelta
         
-        quote_ctx = QuoteContext(config)
+        quote_ctx = get_agent(user_id, config).quote_ctx
         
         # 解析日期
         if date_str:
@@ -1622,79 +2348,88 @@ def get_intraday_data():
                         "warning": "数据获取失败，请稍后重试"
                     })
         
-        for candle in resp:
-            candle_time = candle.timestamp
-            if isinstance(candle_time, str):
-                candle_time = datetime.fromisoformat(candle_time.replace('Z', '+00:00'))
-            
-            # 只保留查询日期当天的数据（考虑夜盘跨天）
-            candle_date = candle_time.date() if hasattr(candle_time, 'date') else query_date
-            
-            # 过滤：只保留查询日期的数据
-            if candle_date != query_date:
-                continue
-            
-            # 判断交易时段
-            hour = candle_time.hour if hasattr(candle_time, 'hour') else 0
-            minute = candle_time.minute if hasattr(candle_time, 'minute') else 0
-            time_val = dt_time(hour, minute)
-            
-            # 美股时段判断（北京时间对应美股时间）
-            # 注意：这里根据市场判断
-            market = symbol.split('.')[-1] if '.' in symbol else 'US'
-            
-            if market == 'US':
-                # 美股时段（美东时间）对应到K线数据的时间
-                # 简化处理：根据时间判断
-                if time_val >= dt_time(20, 0) or time_val < dt_time(4, 0):
-                    session = 'Night'  # 夜盘 20:00-04:00
-                elif time_val >= dt_time(4, 0) and time_val < dt_time(9, 30):
-                    session = 'PreMarket'  # 盘前 04:00-09:30
-                elif time_val >= dt_time(9, 30) and time_val < dt_time(16, 0):
-                    session = 'Regular'  # 盘中 09:30-16:00
-                else:
-                    session = 'AfterHours'  # 盘后 16:00-20:00
-            else:
-                # 港股、A股只有盘中
-                session = 'Regular'
-            
-            candles.append({
-                "timestamp": candle_time.isoformat() if hasattr(candle_time, 'isoformat') else str(candle_time),
+        # 列式存储：单次遍历把K线字段填入预分配的数组
+        resp = list(resp)
+        n = len(resp)
+        raw_timestamps = [None] * n
+        ohlc = np.empty((n, 4), dtype=np.float64)
+        volumes = np.empty(n, dtype=np.int64)
+        for i, candle in enumerate(resp):
+            raw_timestamps[i] = candle.timestamp
+            ohlc[i] = (float(candle.open), float(candle.high), float(candle.low), float(candle.close))
+            volumes[i] = int(candle.volume)
+        
+        # 时间戳整列转换一次（字符串 ISO 时间也在这里统一解析）
+        timestamps = pd.to_datetime(pd.Series(raw_timestamps, dtype=object))
+        
+        # 只保留查询日期当天的数据（考虑夜盘跨天）
+        keep = np.flatnonzero(timestamps.dt.date.to_numpy() == query_date)
+        timestamps = timestamps.iloc[keep]
+        ohlc = ohlc[keep]
+        volumes = volumes[keep]
+        
+        # 按时间排序（长桥通常已按时间顺序返回，已有序时跳过重排）
+        ts_ns = timestamps.to_numpy(dtype='datetime64[ns]').view(np.int64)
+        if np.any(ts_ns[1:] < ts_ns[:-1]):
+            order = np.argsort(ts_ns, kind='stable')
+            timestamps = timestamps.iloc[order]
+            ohlc = ohlc[order]
+            volumes = volumes[order]
+        hours = timestamps.dt.hour.to_numpy()
+        minutes = timestamps.dt.minute.to_numpy()
+        
+        # 判断交易时段（编码为 _SESSION_NAMES 的下标）
+        market = symbol.split('.')[-1] if '.' in symbol else 'US'
+        if market == 'US':
+            # 美股时段（美东时间）按分钟数分桶：
+            # 夜盘 20:00-04:00 / 盘前 04:00-09:30 / 盘中 09:30-16:00 / 盘后 16:00-20:00
+            session_ids = _US_SESSION_CODES[np.searchsorted(_US_SESSION_EDGES, hours * 60 + minutes, side='right')]
+        else:
+            # 港股、A股只有盘中
+            session_ids = np.full(len(keep), _SESSION_NAMES.index('Regular'), dtype=np.uint8)
+        
+        # 按时段分组统计（factors_core 内核单次遍历）
+        counts, opens, highs, lows, closes, session_volumes = session_stats(
+            ohlc, volumes, session_ids, len(_SESSION_NAMES))
+        stats_by_session = {}
+        for code, session in enumerate(_SESSION_NAMES):
+            if counts[code]:
+                stats_by_session[session] = {
+                    "count": int(counts[code]),
+                    "open": float(opens[code]),
+                    "close": float(closes[code]),
+                    "high": float(highs[code]),
+                    "low": float(lows[code]),
+                    "volume": int(session_volumes[code])
+                }
+        
+        # 只在输出时组装为字典列表
+        candles = [
+            {
+                "timestamp": ts.isoformat(),
                 "time": f"{hour:02d}:{minute:02d}",
                 "hour": hour,
                 "minute": minute,
-                "open": float(candle.open),
-                "high": float(candle.high),
-                "low": float(candle.low),
-                "close": float(candle.close),
-                "volume": int(candle.volume),
-                "session": session
-            })
-        
-        # 按时间排序
-        candles.sort(key=lambda x: x['timestamp'])
-        
-        # 按时段分组统计
-        session_stats = {}
-        for session in ['PreMarket', 'Regular', 'AfterHours', 'Night']:
-            session_candles = [c for c in candles if c['session'] == session]
-            if session_candles:
-                session_stats[session] = {
-                    "count": len(session_candles),
-                    "open": session_candles[0]['open'],
-                    "close": session_candles[-1]['close'],
-                    "high": max(c['high'] for c in session_candles),
-                    "low": min(c['low'] for c in session_candles),
-                    "volume": sum(c['volume'] for c in session_candles)
-                }
+                "open": o,
+                "high": h,
+                "low": l,
+                "close": c,
+                "volume": v,
+                "session": _SESSION_NAMES[code]
+            }
+            for ts, hour, minute, (o, h, l, c), v, code in zip(
+                timestamps, hours.tolist(), minutes.tolist(), ohlc.tolist(),
+                volumes.tolist(), session_ids.tolist())
+        ]
         
         print(f"[API] Returning {len(candles)} intraday candles", flush=True)
         
-        return jsonify({
+        # 数千根分钟K线，用 orjson 序列化比 jsonify 快得多
+        return ojsonify({
             "symbol": symbol,
             "date": query_date.isoformat(),
             "candles": candles,
-            "session_stats": session_stats,
+            "session_stats": stats_by_session,
             "total": len(candles)
         })
         
@@ -1705,14 +2440,39 @@ def get_intraday_data():
         return jsonify({"error": str(e), "trace": traceback.format_exc()})
 
 # ============== 静态文件服务（前端） ==============
+# 生产环境建议由 nginx 直接服务 static/ 目录，这里保证单独运行 Flask 时也带缓存头：
+# Vite 产出的 assets/ 文件名带内容哈希，可永久缓存；index.html 每次都需校验
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+STATIC_ASSET_MAX_AGE = 365 * 24 * 3600
+
+def _is_hashed_asset(path: str, url: str = '') -> bool:
+    """assets/ 下的文件名带内容哈希，内容变化时文件名也会变化"""
+    return (url or path).lstrip('/').startswith('assets/')
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve_static(path):
-    """服务前端静态文件"""
-    if path == '':
+    """服务前端静态文件，未知路径回退到 index.html（前端路由）"""
+    if path == '' or (not path.startswith('api/') and not os.path.isfile(os.path.join(STATIC_DIR, path))):
         path = 'index.html'
-    return send_from_directory('static', path)
+    
+    if _is_hashed_asset(path):
+        response = send_from_directory(STATIC_DIR, path, max_age=STATIC_ASSET_MAX_AGE)
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_ASSET_MAX_AGE}, immutable'
+        return response
+    return send_from_directory(STATIC_DIR, path, max_age=0)
+
+if WHITENOISE_AVAILABLE:
+    # 静态文件在进入 Flask 之前由 WhiteNoise 直接返回；找不到的路径仍交给上面的路由
+    app.wsgi_app = WhiteNoise(
+        app.wsgi_app,
+        root=STATIC_DIR,
+        index_file=True,
+        max_age=0,
+        immutable_file_test=_is_hashed_asset
+    )
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8000, debug=False)
\ No newline at end of file
+    # 仅用于本地开发；部署使用 gunicorn -c gunicorn.conf.py app:app
+    app.run(host='0.0.0.0', port=8000, debug=False, threaded=True)
\ No newline at end of file
@@ -7,9 +7,12 @@ import json
 import time
 import secrets
 import hashlib
+import hmac
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 import threading
+import heapq
+from collections import OrderedDict
 
 # 尝试导入Redis，如果没有则使用内存存储
 try:
@@ -21,9 +24,61 @@ except ImportError:
 # 内存存储（Redis不可用时）
 verification_codes: Dict[str, dict] = {}
 users: Dict[str, dict] = {}
-sessions: Dict[str, dict] = {}
+user_id_index: Dict[str, str] = {}  # user_id -> phone
+sessions: Dict[str, Tuple[dict, float]] = {}  # token -> (会话数据, monotonic 过期时间)
 user_credentials: Dict[str, dict] = {}
-lock = threading.Lock()
+
+# 分段锁：按键（手机号/Token/user_id）的哈希选择，不相关用户的操作互不阻塞
+LOCK_STRIPES = 32
+LOCKS = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def lock_for(key: str) -> threading.Lock:
+    """返回键对应的分段锁"""
+    return LOCKS[hash(key) & (LOCK_STRIPES - 1)]
+
+
+# 过期清理：最小堆 (过期时间, 类型, 键)，后台线程定期弹出已过期的条目
+# 内存存储的过期时间均为 time.monotonic()，不受系统时钟调整影响
+GC_INTERVAL_SECONDS = 30
+_expiry_heap: list = []
+_expiry_heap_lock = threading.Lock()
+_gc_thread: Optional[threading.Thread] = None
+# 类型 -> (存储, 取条目过期时间的函数)
+_EXPIRING_STORES = {
+    'code': (verification_codes, lambda entry: entry.get('expire_time', 0)),
+    'session': (sessions, lambda entry: entry[1]),
+}
+
+
+def _push_expiry(expire_time: float, kind: str, key: str):
+    """登记内存条目的过期时间"""
+    with _expiry_heap_lock:
+        heapq.heappush(_expiry_heap, (expire_time, kind, key))
+
+
+def _gc_expired(now: Optional[float] = None):
+    """删除已过期的验证码和会话（条目被重新保存过则以最新的过期时间为准）"""
+    now = time.monotonic() if now is None else now
+    while True:
+        with _expiry_heap_lock:
+            if not _expiry_heap or _expiry_heap[0][0] > now:
+                return
+            _, kind, key = heapq.heappop(_expiry_heap)
+        store, deadline_of = _EXPIRING_STORES[kind]
+        with lock_for(key):
+            entry = store.get(key)
+            if entry is not None and deadline_of(entry) <= now:
+                del store[key]
+
+
+def _gc_loop():
+    while True:
+        time.sleep(GC_INTERVAL_SECONDS)
+        _gc_expired()
+
+
+_DIGITS = b'0123456789'
 
 
 class AuthService:
@@ -32,6 +87,8 @@ class AuthService:
     CODE_EXPIRE_MINUTES = 5  # 验证码5分钟有效
     TOKEN_EXPIRE_DAYS = 7    # Token 7天有效
     MAX_ATTEMPTS = 3         # 最多尝试3次
+    TOKEN_CACHE_SIZE = 4096  # 进程内缓存的Token数
+    TOKEN_CACHE_SECONDS = 60 # Token缓存有效期（秒）
     
     def __init__(self, sms_service=None, redis_client=None, sign_name: str = '量化分析系统', template_code: str = 'SMS_12345678'):
         """
@@ -47,67 +104,128 @@ class AuthService:
         self.sign_name = sign_name
         self.template_code = template_code
         
+        # validate_token 缓存：token -> (写入时的退出登录代数, 用户信息, 缓存过期时间)
+        # 任何一次退出登录都会使代数加一，使所有缓存条目失效；使用 Redis 时代数保存在 Redis 中，
+        # 多个 gunicorn worker 共享，任一 worker 处理的退出登录对所有 worker 立即生效
+        self._token_cache: OrderedDict = OrderedDict()
+        self._token_cache_lock = threading.Lock()
+        self._logout_gen = 0
+        
         if self.use_redis:
             print("[INFO] AuthService: 使用Redis存储")
         else:
             print("[INFO] AuthService: 使用内存存储")
+            self._start_gc()
+    
+    @staticmethod
+    def _start_gc():
+        """启动内存存储的过期清理线程（进程内只启动一次）"""
+        global _gc_thread
+        with _expiry_heap_lock:
+            if _gc_thread is None:
+                _gc_thread = threading.Thread(target=_gc_loop, name='auth-gc', daemon=True)
+                _gc_thread.start()
     
     def _get_redis_key(self, prefix: str, key: str) -> str:
         """生成Redis键名"""
         return f"stockapp:{prefix}:{key}"
     
+    def _hset_with_ttl(self, key: str, data: dict, ttl: int, pipe=None):
+        """
+        以 Redis Hash 保存并设置过期时间（先删除以覆盖旧的 JSON 字符串键）
+        
+        传入 pipe 时只把命令加入该管道，由调用方统一执行；否则单独一次往返
+        """
+        own_pipe = pipe is None
+        if own_pipe:
+            pipe = self.redis.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping=data)
+        pipe.expire(key, ttl)
+        if own_pipe:
+            pipe.execute()
+    
+    def _hgetall(self, key: str) -> Optional[dict]:
+        """读取 Redis Hash，兼容改用 Hash 之前写入的 JSON 字符串键"""
+        try:
+            return self.redis.hgetall(key) or None
+        except redis.ResponseError:
+            data = self.redis.get(key)
+            return json.loads(data) if data else None
+    
     def _save_code(self, phone: str, code_data: dict):
         """保存验证码"""
         if self.use_redis:
             key = self._get_redis_key("code", phone)
-            self.redis.setex(key, self.CODE_EXPIRE_MINUTES * 60, json.dumps(code_data))
+            self._hset_with_ttl(key, code_data, self.CODE_EXPIRE_MINUTES * 60)
         else:
-            with lock:
-                verification_codes[phone] = code_data
+            expire_time = time.monotonic() + self.CODE_EXPIRE_MINUTES * 60
+            with lock_for(phone):
+                verification_codes[phone] = {**code_data, 'expire_time': expire_time}
+            _push_expiry(expire_time, 'code', phone)
     
     def _get_code(self, phone: str) -> Optional[dict]:
         """获取验证码"""
         if self.use_redis:
             key = self._get_redis_key("code", phone)
-            data = self.redis.get(key)
-            return json.loads(data) if data else None
+            return self._decode_code(self._hgetall(key))
         else:
-            with lock:
-                return verification_codes.get(phone)
+            with lock_for(phone):
+                record = verification_codes.get(phone)
+                if record and time.monotonic() > record.get('expire_time', 0):
+                    del verification_codes[phone]
+                    return None
+                return record
+    
+    @staticmethod
+    def _decode_code(data: Optional[dict]) -> Optional[dict]:
+        """Hash 字段均为字符串，还原验证码记录的数值类型"""
+        if not data:
+            return None
+        return {
+            'code': data['code'],
+            'send_time': float(data['send_time']),
+            'attempts': int(data['attempts'])
+        }
     
-    def _delete_code(self, phone: str):
+    def _delete_code(self, phone: str, pipe=None):
         """删除验证码"""
         if self.use_redis:
             key = self._get_redis_key("code", phone)
-            self.redis.delete(key)
+            (pipe or self.redis).delete(key)
         else:
-            with lock:
+            with lock_for(phone):
                 if phone in verification_codes:
                     del verification_codes[phone]
     
-    def _save_session(self, token: str, session_data: dict, expire_days: int = 7):
+    def _save_session(self, token: str, session_data: dict, expire_days: int = 7, pipe=None):
         """保存登录会话"""
         expire_seconds = expire_days * 24 * 3600
         if self.use_redis:
             key = self._get_redis_key("session", token)
-            self.redis.setex(key, expire_seconds, json.dumps(session_data))
+            self._hset_with_ttl(key, session_data, expire_seconds, pipe)
         else:
-            with lock:
-                sessions[token] = {**session_data, 'expire_time': time.time() + expire_seconds}
+            deadline = time.monotonic() + expire_seconds
+            with lock_for(token):
+                sessions[token] = (dict(session_data), deadline)
+            _push_expiry(deadline, 'session', token)
     
-    def _get_session(self, token: str) -> Optional[dict]:
-        """获取会话"""
+    def _get_session_entry(self, token: str) -> Optional[Tuple[dict, float]]:
+        """获取会话及其 monotonic 过期时间（Redis 由 TTL 负责过期，过期时间记为 inf）"""
         if self.use_redis:
             key = self._get_redis_key("session", token)
-            data = self.redis.get(key)
-            return json.loads(data) if data else None
+            session = self._hgetall(key)
+            return (session, float('inf')) if session else None
         else:
-            with lock:
-                session = sessions.get(token)
-                if session and time.time() > session.get('expire_time', 0):
-                    del sessions[token]
-                    return None
-                return session
+            entry = sessions.get(token)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            return entry
+    
+    def _get_session(self, token: str) -> Optional[dict]:
+        """获取会话"""
+        entry = self._get_session_entry(token)
+        return entry[0] if entry else None
     
     def _delete_session(self, token: str):
         """删除会话"""
@@ -115,17 +233,21 @@ class AuthService:
             key = self._get_redis_key("session", token)
             self.redis.delete(key)
         else:
-            with lock:
+            with lock_for(token):
                 sessions.pop(token, None)
     
-    def _save_user(self, phone: str, user_data: dict):
-        """保存用户信息"""
+    def _save_user(self, phone: str, user_data: dict, pipe=None):
+        """保存用户信息（同时维护 user_id -> phone 索引）"""
         if self.use_redis:
+            r = pipe or self.redis
             key = self._get_redis_key("user", phone)
-            self.redis.set(key, json.dumps(user_data))
+            r.set(key, json.dumps(user_data))
+            r.set(self._get_redis_key("uid", user_data['user_id']), phone)
         else:
-            with lock:
+            with lock_for(phone):
                 users[phone] = user_data
+            with lock_for(user_data['user_id']):
+                user_id_index[user_data['user_id']] = phone
     
     def _get_user(self, phone: str) -> Optional[dict]:
         """获取用户信息"""
@@ -134,7 +256,7 @@ class AuthService:
             data = self.redis.get(key)
             return json.loads(data) if data else None
         else:
-            with lock:
+            with lock_for(phone):
                 return users.get(phone)
     
     def _save_credentials(self, user_id: str, creds: dict):
@@ -143,7 +265,7 @@ class AuthService:
             key = self._get_redis_key("creds", user_id)
             self.redis.set(key, json.dumps(creds))
         else:
-            with lock:
+            with lock_for(user_id):
                 user_credentials[user_id] = creds
     
     def _get_credentials(self, user_id: str) -> Optional[dict]:
@@ -153,12 +275,22 @@ class AuthService:
             data = self.redis.get(key)
             return json.loads(data) if data else None
         else:
-            with lock:
+            with lock_for(user_id):
                 return user_credentials.get(user_id)
     
     def generate_code(self, length: int = 6) -> str:
-        """生成随机验证码"""
-        return ''.join([str(secrets.randbelow(10)) for _ in range(length)])
+        """生成随机验证码（一次取随机字节，丢弃 >= 250 的字节保证各数字等概率）"""
+        buf = secrets.token_bytes(length * 2)
+        out = bytearray(length)
+        j = 0
+        for b in buf:
+            if b < 250:
+                out[j] = _DIGITS[b % 10]
+                j += 1
+                if j == length:
+                    return out.decode('ascii')
+        # 有效字节不足（极少发生）时重新生成
+        return self.generate_code(length)
     
     def generate_token(self) -> str:
         """生成随机Token"""
@@ -224,8 +356,10 @@ class AuthService:
         if not phone or len(phone) != 11:
             return {'success': False, 'message': '手机号格式不正确'}
         
-        # 检查验证码
-        record = self._get_code(phone)
+        code = str(code).strip()
+        
+        # 检查验证码（同时读取用户信息，Redis 下一次往返）
+        record, user = self._load_login_state(phone)
         
         if not record:
             return {'success': False, 'message': '请先获取验证码'}
@@ -236,38 +370,31 @@ class AuthService:
             return {'success': False, 'message': '尝试次数过多，请重新获取'}
         
         record['attempts'] += 1
-        self._save_code(phone, record)
         
-        if record['code'] != code:
+        # 常量时间比较，避免计时侧信道
+        if not hmac.compare_digest(record['code'].encode(), code.encode()):
+            self._save_code(phone, record)
             remaining = self.MAX_ATTEMPTS - record['attempts']
             return {
                 'success': False, 
                 'message': f'验证码错误，还剩{remaining}次机会'
             }
         
-        # 验证成功，删除验证码
-        self._delete_code(phone)
-        
-        # 创建或获取用户
-        user = self._get_user(phone)
+        # 验证成功：创建或更新用户
+        now_iso = datetime.now().isoformat()
         if not user:
             user = {
                 'user_id': secrets.token_hex(16),
                 'phone': phone,
-                'created_at': datetime.now().isoformat(),
-                'last_login': datetime.now().isoformat()
+                'created_at': now_iso,
+                'last_login': now_iso
             }
         else:
-            user['last_login'] = datetime.now().isoformat()
-        
-        self._save_user(phone, user)
+            user['last_login'] = now_iso
         
-        # 生成Token
+        # 删除验证码、保存用户和会话、查询凭证（Redis 下一次往返）
         token = self.generate_token()
-        self._save_session(token, {
-            'phone': phone,
-            'user_id': user['user_id']
-        })
+        has_longbridge = self._complete_login(phone, user, token)
         
         return {
             'success': True,
@@ -277,27 +404,85 @@ class AuthService:
                 'user_id': user['user_id'],
                 'phone': user['phone'],
                 'created_at': user['created_at'],
-                'has_longbridge': self._get_credentials(user['user_id']) is not None
+                'has_longbridge': has_longbridge
             }
         }
     
+    def _load_login_state(self, phone: str) -> Tuple[Optional[dict], Optional[dict]]:
+        """读取 (验证码记录, 用户信息)"""
+        if not self.use_redis:
+            return self._get_code(phone), self._get_user(phone)
+        
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(self._get_redis_key("code", phone))
+        pipe.get(self._get_redis_key("user", phone))
+        code_data, user_data = pipe.execute(raise_on_error=False)
+        if isinstance(code_data, redis.ResponseError):
+            # 改用 Hash 之前写入的验证码
+            record = self._get_code(phone)
+        else:
+            record = self._decode_code(code_data)
+        return record, (json.loads(user_data) if user_data else None)
+    
+    def _complete_login(self, phone: str, user: dict, token: str) -> bool:
+        """删除验证码、保存用户和会话，返回用户是否已绑定LongBridge凭证"""
+        session_data = {'phone': phone, 'user_id': user['user_id']}
+        if not self.use_redis:
+            self._delete_code(phone)
+            self._save_user(phone, user)
+            self._save_session(token, session_data, self.TOKEN_EXPIRE_DAYS)
+            return self._get_credentials(user['user_id']) is not None
+        
+        pipe = self.redis.pipeline()
+        self._delete_code(phone, pipe)
+        self._save_user(phone, user, pipe)
+        self._save_session(token, session_data, self.TOKEN_EXPIRE_DAYS, pipe)
+        pipe.get(self._get_redis_key("creds", user['user_id']))
+        return pipe.execute()[-1] is not None
+    
     def validate_token(self, token: str) -> Optional[dict]:
-        """验证Token是否有效"""
+        """验证Token是否有效（有效结果在进程内缓存 TOKEN_CACHE_SECONDS 秒）"""
         if not token:
             return None
         
-        session = self._get_session(token)
-        if not session:
+        now = time.monotonic()
+        gen = self._current_logout_gen()
+        cached = self._token_cache.get(token)
+        if cached is not None and cached[0] == gen and cached[2] > now:
+            return cached[1]
+        
+        entry = self._get_session_entry(token)
+        if not entry:
             return None
         
-        return {
+        session, deadline = entry
+        user = {
             'phone': session['phone'],
             'user_id': session['user_id']
         }
+        # 缓存不超过会话本身的过期时间
+        cache_expire = min(now + self.TOKEN_CACHE_SECONDS, deadline)
+        with self._token_cache_lock:
+            self._token_cache[token] = (gen, user, cache_expire)
+            self._token_cache.move_to_end(token)
+            while len(self._token_cache) > self.TOKEN_CACHE_SIZE:
+                self._token_cache.popitem(last=False)
+        return user
+    
+    def _current_logout_gen(self) -> int:
+        """当前的退出登录代数（使用 Redis 时读取所有 worker 共享的计数）"""
+        if self.use_redis:
+            return int(self.redis.get(self._get_redis_key("auth", "logout_gen")) or 0)
+        return self._logout_gen
     
     def logout(self, token: str) -> bool:
         """退出登录"""
         self._delete_session(token)
+        if self.use_redis:
+            self.redis.incr(self._get_redis_key("auth", "logout_gen"))
+        with self._token_cache_lock:
+            self._logout_gen += 1
+            self._token_cache.pop(token, None)
         return True
     
     def get_user(self, phone: str) -> Optional[dict]:
@@ -306,12 +491,13 @@ class AuthService:
     
     def bind_longport_credentials(self, user_id: str, api_key: str, api_secret: str, access_token: str) -> dict:
         """绑定LongBridge API凭证到用户账户"""
+        now_iso = datetime.now().isoformat()
         self._save_credentials(user_id, {
             'api_key': api_key,
             'api_secret': api_secret,
             'access_token': access_token,
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat()
+            'created_at': now_iso,
+            'updated_at': now_iso
         })
         return {'success': True, 'message': '凭证绑定成功'}
     
@@ -325,6 +511,15 @@ class AuthService:
     
     def get_user_by_id(self, user_id: str) -> Optional[dict]:
         """通过user_id获取用户信息"""
+        if self.use_redis:
+            phone = self.redis.get(self._get_redis_key("uid", user_id))
+        else:
+            with lock_for(user_id):
+                phone = user_id_index.get(user_id)
+        if phone:
+            return self._get_user(phone)
+        
+        # 索引建立之前保存的用户：扫描一次并补写索引
         if self.use_redis:
             pattern = self._get_redis_key("user", "*")
             for key in self.redis.scan_iter(match=pattern):
@@ -332,11 +527,7 @@ class AuthService:
                 if data:
                     user = json.loads(data)
                     if user.get('user_id') == user_id:
-                        return user
-        else:
-            with lock:
-                for phone, user in users.items():
-                    if user.get('user_id') == user_id:
+                        self.redis.set(self._get_redis_key("uid", user_id), user['phone'])
                         return user
         return None
 
@@ -0,0 +1,269 @@
+"""
+因子计算、回测与分时统计的数值内核
+使用 Numba JIT 编译滚动统计量和回测指标，尽量在一次遍历中得到多个结果；
+未安装 numba 时退化为同样逻辑的纯 Python 实现
+"""
+
+import numpy as np
+
+# 尝试导入Numba，如果没有则不做JIT编译
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """numba.njit 的占位装饰器，直接返回原函数"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+
+@njit(cache=True)
+def rolling_mean_std(values: np.ndarray, window: int):
+    """
+    滚动均值和样本标准差 (ddof=1)，单次遍历
+
+    与 pandas rolling(window).mean()/std() 一致：窗口内有效值不足 window 个时为 NaN
+
+    Returns:
+        (mean, std) 两个与输入等长的 float64 数组
+    """
+    n = len(values)
+    mean_out = np.full(n, np.nan)
+    std_out = np.full(n, np.nan)
+
+    nobs = 0
+    mean = 0.0
+    ssqdm = 0.0  # 离均差平方和 (Welford)
+
+    for i in range(n):
+        # 加入新值
+        val = values[i]
+        if val == val:
+            nobs += 1
+            delta = val - mean
+            mean += delta / nobs
+            ssqdm += (nobs - 1) * delta * delta / nobs
+
+        # 移出窗口外的旧值
+        if i >= window:
+            old = values[i - window]
+            if old == old:
+                nobs -= 1
+                if nobs > 0:
+                    delta = old - mean
+                    mean -= delta / nobs
+                    ssqdm -= (nobs + 1) * delta * delta / nobs
+                else:
+                    mean = 0.0
+                    ssqdm = 0.0
+
+        if nobs >= window:
+            mean_out[i] = mean
+            if nobs > 1:
+                std_out[i] = np.sqrt(max(ssqdm, 0.0) / (nobs - 1))
+            else:
+                std_out[i] = 0.0
+
+    return mean_out, std_out
+
+
+@njit(cache=True)
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """滚动均值，与 pandas rolling(window).mean() 一致"""
+    n = len(values)
+    out = np.full(n, np.nan)
+
+    nobs = 0
+    total = 0.0
+    for i in range(n):
+        val = values[i]
+        if val == val:
+            nobs += 1
+            total += val
+        if i >= window:
+            old = values[i - window]
+            if old == old:
+                nobs -= 1
+                total -= old
+        if nobs >= window:
+            out[i] = total / nobs
+
+    return out
+
+
+@njit(cache=True)
+def rolling_max(values: np.ndarray, window: int) -> np.ndarray:
+    """滚动最大值，单调队列实现 O(N)，与 pandas rolling(window).max() 一致"""
+    n = len(values)
+    out = np.full(n, np.nan)
+
+    # 单调递减队列，保存下标
+    dq = np.empty(n, dtype=np.int64)
+    head = 0
+    tail = 0
+    nobs = 0
+
+    for i in range(n):
+        val = values[i]
+        if val == val:
+            nobs += 1
+            while tail > head and values[dq[tail - 1]] <= val:
+                tail -= 1
+            dq[tail] = i
+            tail += 1
+
+        if i >= window:
+            old = values[i - window]
+            if old == old:
+                nobs -= 1
+            if tail > head and dq[head] <= i - window:
+                head += 1
+
+        if nobs >= window:
+            out[i] = values[dq[head]]
+
+    return out
+
+
+@njit(cache=True)
+def rolling_min_drawdown(close: np.ndarray, window: int) -> np.ndarray:
+    """
+    相对历史最高点回撤的滚动最小值，单次遍历
+
+    等价于 ((close - close.cummax()) / close.cummax()).rolling(window).min()，
+    回撤和单调队列滚动最小值融合在同一个循环里
+    """
+    n = len(close)
+    out = np.full(n, np.nan)
+    dd = np.full(n, np.nan)
+
+    # 单调递增队列，保存下标
+    dq = np.empty(n, dtype=np.int64)
+    head = 0
+    tail = 0
+    nobs = 0
+    running_max = np.nan
+
+    for i in range(n):
+        val = close[i]
+        if val == val:
+            if not (running_max >= val):
+                running_max = val
+            dd[i] = (val - running_max) / running_max
+            nobs += 1
+            while tail > head and dd[dq[tail - 1]] >= dd[i]:
+                tail -= 1
+            dq[tail] = i
+            tail += 1
+
+        if i >= window:
+            if close[i - window] == close[i - window]:
+                nobs -= 1
+            if tail > head and dq[head] <= i - window:
+                head += 1
+
+        if nobs >= window:
+            out[i] = dd[dq[head]]
+
+    return out
+
+
+@njit(cache=True)
+def backtest_kernel(close: np.ndarray, position: np.ndarray):
+    """
+    回测收益和指标，单次遍历
+
+    持仓滞后一天生效：第 i 天策略收益 = position[i-1] * (close[i] / close[i-1] - 1)，
+    第 0 天没有收益 (NaN)；累计净值由 log1p 累加后取 exp 得到，
+    避免长序列上连乘的误差累积
+
+    Returns:
+        (cum_market, cum_strategy, max_drawdown, return_std, n_wins, n_trades)
+        cum_market/cum_strategy 为累计净值序列，return_std 为策略日收益的样本标准差
+    """
+    n = len(close)
+    cum_market = np.full(n, np.nan)
+    cum_strategy = np.full(n, np.nan)
+
+    mkt_log = 0.0
+    strat_log = 0.0
+    peak = -np.inf
+    max_dd = np.nan
+
+    # 策略日收益的 Welford 累计量
+    nobs = 0
+    mean = 0.0
+    m2 = 0.0
+    n_wins = 0
+    n_trades = 0
+
+    for i in range(1, n):
+        daily_ret = close[i] / close[i - 1] - 1.0
+        strat_ret = position[i - 1] * daily_ret
+
+        # 单日亏损达到 100% 及以上时净值归零
+        mkt_log += np.log1p(daily_ret) if daily_ret > -1.0 else -np.inf
+        strat_log += np.log1p(strat_ret) if strat_ret > -1.0 else -np.inf
+        mkt = np.exp(mkt_log)
+        strat = np.exp(strat_log)
+        cum_market[i] = mkt
+        cum_strategy[i] = strat
+
+        # 最大回撤
+        if strat > peak:
+            peak = strat
+        dd = (strat - peak) / peak
+        if not (max_dd <= dd):
+            max_dd = dd
+
+        nobs += 1
+        delta = strat_ret - mean
+        mean += delta / nobs
+        m2 += delta * (strat_ret - mean)
+
+        if strat_ret > 0:
+            n_wins += 1
+        if strat_ret != 0:
+            n_trades += 1
+
+    return_std = np.sqrt(m2 / (nobs - 1)) if nobs > 1 else np.nan
+    return cum_market, cum_strategy, max_dd, return_std, n_wins, n_trades
+
+
+@njit(cache=True, boundscheck=False)
+def session_stats(ohlc: np.ndarray, volumes: np.ndarray, session_ids: np.ndarray, n_sessions: int):
+    """
+    按交易时段汇总分时K线，单次遍历
+
+    K线需已按时间排序；ohlc 为 (n, 4) 的 open/high/low/close，session_ids 为时段编号 (0..n_sessions-1)
+
+    Returns:
+        (count, open, high, low, close, volume) 六个长度为 n_sessions 的数组，
+        count 为 0 的时段其余值无意义
+    """
+    count = np.zeros(n_sessions, dtype=np.int64)
+    open_ = np.full(n_sessions, np.nan)
+    high = np.full(n_sessions, np.nan)
+    low = np.full(n_sessions, np.nan)
+    close = np.full(n_sessions, np.nan)
+    volume = np.zeros(n_sessions, dtype=np.int64)
+
+    for i in range(len(session_ids)):
+        s = session_ids[i]
+        if count[s] == 0:
+            open_[s] = ohlc[i, 0]
+            high[s] = ohlc[i, 1]
+            low[s] = ohlc[i, 2]
+        else:
+            if ohlc[i, 1] > high[s]:
+                high[s] = ohlc[i, 1]
+            if ohlc[i, 2] < low[s]:
+                low[s] = ohlc[i, 2]
+        close[s] = ohlc[i, 3]
+        volume[s] += volumes[i]
+        count[s] += 1
+
+    return count, open_, high, low, close, volume
@@ -0,0 +1,30 @@
+"""
+gunicorn 部署配置
+
+启动: cd backend && gunicorn -c gunicorn.conf.py app:app
+
+使用 gthread 线程 worker：LongPort SDK 的行情请求、短信和 Redis 调用都是阻塞 I/O，
+多线程即可并发处理；gevent 的 monkey patch 无法让 LongPort 原生扩展内部的阻塞调用让出，
+还会干扰训练线程池，因此不使用。
+"""
+
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+worker_class = 'gthread'
+
+# 未配置 Redis 时验证码/会话和异步训练任务状态都只保存在进程内，只能用单进程，
+# 否则登录状态和 /api/ml/status 查询会在 worker 之间丢失；行情连接池始终按进程各自维护
+workers = int(os.environ.get('WEB_WORKERS', 1))
+threads = int(os.environ.get('WEB_THREADS', 8))
+
+# 回测、组合分析等接口可能耗时较长
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+# 收到 SIGTERM 后等待进行中的请求（如同步训练）完成的时间；start_server.py 按同一环境变量
+# 再多等几秒才发送 SIGKILL，两者需保持一致
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info').lower()
@@ -4,11 +4,15 @@
 """
 
 import json
+import threading
 from alibabacloud_dypnsapi20170525.client import Client as DypnsapiClient
 from alibabacloud_tea_openapi import models as open_api_models
 from alibabacloud_dypnsapi20170525 import models as dypnsapi_models
 from alibabacloud_tea_util import models as util_models
 
+# 请求运行时参数，无单次请求状态，全局复用
+RUNTIME_OPTIONS = util_models.RuntimeOptions()
+
 
 class AliyunSMS:
     """阿里云号码认证服务 - 发送验证码"""
@@ -17,6 +21,17 @@ class AliyunSMS:
         self.access_key_id = access_key_id
         self.access_key_secret = access_key_secret
         self.endpoint = "dypnsapi.aliyuncs.com"
+        self._client = None
+        self._client_lock = threading.Lock()
+    
+    @property
+    def client(self) -> DypnsapiClient:
+        """阿里云客户端，首次使用时创建并复用"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
         
     def _create_client(self) -> DypnsapiClient:
         """创建阿里云客户端"""
@@ -41,7 +56,7 @@ class AliyunSMS:
             {"success": True/False, "message": "...", "request_id": "..."}
         """
         try:
-            client = self._create_client()
+            client = self.client
             
             # 构造请求
             request = dypnsapi_models.SendSmsVerifyCodeRequest(
@@ -51,13 +66,11 @@ class AliyunSMS:
                 template_param=json.dumps(template_param)
             )
             
-            runtime = util_models.RuntimeOptions()
-            
             # 发送请求
             print(f"[SMS] Sending to {phone_number}, sign={sign_name}, template={template_code}")
             print(f"[SMS] Template param: {template_param}")
             
-            resp = client.send_sms_verify_code_with_options(request, runtime)
+            resp = client.send_sms_verify_code_with_options(request, RUNTIME_OPTIONS)
             
             # 解析响应
             resp_body = resp.body
@@ -100,10 +113,6 @@ class AliyunSMS:
             }
 
 
-# 兼容旧接口
-AliyunSMS.send_sms = AliyunSMS.send_sms
-
-
 # 测试代码
 if __name__ == '__main__':
     import os
@@ -0,0 +1,39 @@
+"""validate_token 进程内缓存与退出登录失效的测试"""
+import pytest
+
+import auth_service
+
+
+def _login(auth, token='tok-1'):
+    auth._save_session(token, {'phone': '13800138000', 'user_id': 'u1'})
+    return token
+
+
+def test_cached_token_is_invalidated_by_logout():
+    auth = auth_service.AuthService()
+    token = _login(auth)
+    assert auth.validate_token(token) == {'phone': '13800138000', 'user_id': 'u1'}
+    assert token in auth._token_cache
+    auth.logout(token)
+    assert auth.validate_token(token) is None
+
+
+def test_cache_hit_skips_session_lookup(monkeypatch):
+    auth = auth_service.AuthService()
+    token = _login(auth)
+    auth.validate_token(token)
+    monkeypatch.setattr(auth, '_get_session_entry', lambda t: pytest.fail("cache miss"))
+    assert auth.validate_token(token)['user_id'] == 'u1'
+
+
+def test_logout_in_one_worker_invalidates_other_workers():
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    worker_a = auth_service.AuthService(redis_client=fakeredis.FakeRedis(server=server, decode_responses=True))
+    worker_b = auth_service.AuthService(redis_client=fakeredis.FakeRedis(server=server, decode_responses=True))
+    token = _login(worker_a)
+    # 两个 worker 都缓存了该 token
+    assert worker_a.validate_token(token) is not None
+    assert worker_b.validate_token(token) is not None
+    worker_a.logout(token)
+    assert worker_b.validate_token(token) is None
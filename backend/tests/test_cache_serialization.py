@@ -0,0 +1,43 @@
+"""DataFrame 缓存序列化（npz，不使用 pickle）的往返测试"""
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+def _quotes_frame(tz=None):
+    dates = pd.date_range('2024-01-02', periods=5, freq='B', tz=tz)
+    return pd.DataFrame({
+        "date": dates,
+        "open": np.linspace(10, 11, 5),
+        "close": np.linspace(10.5, 11.5, 5).astype(np.float32),
+        "volume": np.array([1, 2 ** 40, 3, 4, 5], dtype=np.int64),
+        "halted": [False, True, False, False, False],
+    })
+
+
+@pytest.mark.parametrize("tz", [None, "UTC", "Asia/Shanghai"])
+def test_round_trip_keeps_dtypes_and_values(tz):
+    df = _quotes_frame(tz)
+    restored = app._df_from_bytes(app._df_to_bytes(df))
+    pd.testing.assert_frame_equal(restored, df)
+
+
+def test_round_trip_date_supports_incremental_fetch():
+    # _fetch_daily_candles 依赖缓存的日期列仍是 Timestamp
+    restored = app._df_from_bytes(app._df_to_bytes(_quotes_frame("Asia/Shanghai")))
+    assert restored['date'].iloc[-1].date() == pd.Timestamp('2024-01-08').date()
+
+
+def test_object_columns_are_rejected():
+    df = _quotes_frame().assign(symbol="AAPL.US")
+    with pytest.raises(TypeError):
+        app._df_to_bytes(df)
+
+
+def test_pickle_payload_is_not_loaded():
+    with pytest.raises(ValueError):
+        app._df_from_bytes(pickle.dumps(_quotes_frame()))
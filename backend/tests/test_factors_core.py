@@ -0,0 +1,69 @@
+"""factors_core 数值内核与 pandas 参考实现的等价性测试"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from factors_core import (
+    backtest_kernel,
+    rolling_max,
+    rolling_mean,
+    rolling_mean_std,
+    rolling_min_drawdown,
+)
+
+
+@pytest.fixture
+def prices():
+    rng = np.random.default_rng(7)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 400)))
+    # 停牌等造成的缺失值
+    close[[0, 57, 58, 200]] = np.nan
+    return close
+
+
+@pytest.mark.parametrize("window", [1, 5, 20, 60])
+def test_rolling_mean_std_matches_pandas(prices, window):
+    mean, std = rolling_mean_std(prices, window)
+    rolling = pd.Series(prices).rolling(window)
+    np.testing.assert_allclose(mean, rolling.mean().to_numpy(), rtol=1e-9, equal_nan=True)
+    np.testing.assert_allclose(std, rolling.std().fillna(0.0).where(rolling.count() >= window).to_numpy(),
+                               rtol=1e-7, atol=1e-9, equal_nan=True)
+
+
+@pytest.mark.parametrize("window", [5, 20])
+def test_rolling_mean_matches_pandas(prices, window):
+    expected = pd.Series(prices).rolling(window).mean().to_numpy()
+    np.testing.assert_allclose(rolling_mean(prices, window), expected, rtol=1e-9, equal_nan=True)
+
+
+@pytest.mark.parametrize("window", [5, 20])
+def test_rolling_max_matches_pandas(prices, window):
+    expected = pd.Series(prices).rolling(window).max().to_numpy()
+    np.testing.assert_array_equal(rolling_max(prices, window), expected)
+
+
+def test_rolling_min_drawdown_matches_pandas(prices):
+    close = pd.Series(prices)
+    running_max = close.cummax()
+    expected = ((close - running_max) / running_max).rolling(60).min().to_numpy()
+    np.testing.assert_allclose(rolling_min_drawdown(prices, 60), expected, rtol=1e-12, equal_nan=True)
+
+
+def test_backtest_kernel_matches_pandas():
+    rng = np.random.default_rng(3)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 300)))
+    position = (rng.random(300) > 0.5).astype(np.float64)
+
+    cum_market, cum_strategy, max_dd, return_std, n_wins, n_trades = backtest_kernel(close, position)
+
+    daily = pd.Series(close).pct_change()
+    strategy = pd.Series(position).shift(1) * daily
+    expected_market = (1 + daily).cumprod()
+    expected_strategy = (1 + strategy).cumprod()
+    np.testing.assert_allclose(cum_market, expected_market.to_numpy(), rtol=1e-9, equal_nan=True)
+    np.testing.assert_allclose(cum_strategy, expected_strategy.to_numpy(), rtol=1e-9, equal_nan=True)
+    peak = expected_strategy.cummax()
+    assert max_dd == pytest.approx(((expected_strategy - peak) / peak).min(), rel=1e-9)
+    assert return_std == pytest.approx(strategy.std(), rel=1e-9)
+    assert n_wins == int((strategy > 0).sum())
+    assert n_trades == int((strategy.fillna(0) != 0).sum())
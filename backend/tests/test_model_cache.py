@@ -0,0 +1,71 @@
+"""MLModel LightGBM Booster 缓存与 refit 策略的测试"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture
+def features():
+    rng = np.random.default_rng(5)
+    n = 900
+    X = pd.DataFrame(rng.normal(size=(n, 6)), columns=[f"f{i}" for i in range(6)]).astype(np.float32)
+    y = pd.Series(X['f0'].to_numpy() * 0.01 + rng.normal(0, 0.01, n))
+    return X, y
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """记录完整训练和 refit 的次数"""
+    app._model_cache.clear()
+    recorded = []
+    fit, refit = app.lgb.LGBMRegressor.fit, app.lgb.Booster.refit
+    monkeypatch.setattr(app.lgb.LGBMRegressor, 'fit',
+                        lambda self, *a, **kw: (recorded.append('fit'), fit(self, *a, **kw))[1])
+    monkeypatch.setattr(app.lgb.Booster, 'refit',
+                        lambda self, *a, **kw: (recorded.append('refit'), refit(self, *a, **kw))[1])
+    yield recorded
+    app._model_cache.clear()
+
+
+def _train(X, y):
+    return app.MLModel("lightgbm").train(X, y, cache_key="AAPL.US")
+
+
+def test_same_window_reuses_grown_booster(features, calls):
+    X, y = features
+    first = _train(X.iloc[100:600], y.iloc[100:600])
+    second = _train(X.iloc[100:600], y.iloc[100:600])
+    assert calls == ['fit']
+    assert first == second
+
+
+def test_few_appended_rows_refit_from_grown_booster(features, calls):
+    X, y = features
+    _train(X.iloc[100:600], y.iloc[100:600])
+    _train(X.iloc[105:605], y.iloc[105:605])
+    _train(X.iloc[108:608], y.iloc[108:608])
+    assert calls == ['fit', 'refit', 'refit']
+    # refit 结果不写回缓存，缓存中仍是完整训练的 Booster
+    (entry,) = app._model_cache.values()
+    assert len(entry[2]) == 400
+
+
+def test_unrelated_or_long_window_fits_fresh(features, calls):
+    X, y = features
+    _train(X.iloc[100:600], y.iloc[100:600])
+    # 追加行数超过 MODEL_REFIT_MAX_NEW_ROWS
+    _train(X.iloc[150:650], y.iloc[150:650])
+    # 不同长度（如 1y 与 3y）落在不同的缓存键
+    _train(X.iloc[0:880], y.iloc[0:880])
+    assert calls == ['fit', 'fit', 'fit']
+
+
+def test_appended_rows():
+    old = np.array([1, 2, 3, 4], dtype=np.uint64)
+    assert app._appended_rows(old, old) == 0
+    assert app._appended_rows(old, np.array([3, 4, 5, 6], dtype=np.uint64)) == 2
+    # 新窗口改写了旧窗口中的行，或在旧窗口之前开始
+    assert app._appended_rows(old, np.array([2, 9, 4, 5], dtype=np.uint64)) is None
+    assert app._appended_rows(old, np.array([0, 1, 2, 3], dtype=np.uint64)) is None
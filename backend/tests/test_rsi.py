@@ -0,0 +1,48 @@
+"""rsi_14（Wilder 平滑）的回归测试"""
+import numpy as np
+import pandas as pd
+
+import app
+
+
+def _wilder_rsi(close, period=14):
+    """逐行递推的 Wilder RSI 参考实现：平均涨跌幅 avg += (x - avg) / period，首个差分计为 0"""
+    avg_gain = avg_loss = 0.0
+    out = np.full(len(close), np.nan)
+    for i in range(len(close)):
+        delta = close[i] - close[i - 1] if i > 0 else 0.0
+        gain, loss = max(delta, 0.0), max(-delta, 0.0)
+        if i == 0:
+            avg_gain, avg_loss = gain, loss
+        else:
+            avg_gain += (gain - avg_gain) / period
+            avg_loss += (loss - avg_loss) / period
+        if i >= period - 1:
+            out[i] = 100 - 100 / (1 + avg_gain / avg_loss) if avg_loss else 100.0
+    return out
+
+
+def _rsi(close):
+    df = pd.DataFrame({
+        'date': pd.bdate_range('2023-01-02', periods=len(close)),
+        'open': close, 'high': close * 1.01, 'low': close * 0.99, 'close': close,
+        'volume': np.full(len(close), 1e6), 'amount': close * 1e6,
+    })
+    calc = app.FactorCalculator(df)
+    calc._precompute_rollings()
+    calc._calc_technical_indicators()
+    return calc.factors['rsi_14'].to_numpy()
+
+
+def test_rsi_matches_wilder_recursion():
+    rng = np.random.default_rng(11)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, 250)))
+    rsi = _rsi(close)
+    np.testing.assert_allclose(rsi, _wilder_rsi(close), rtol=1e-9, equal_nan=True)
+    assert np.isnan(rsi[:13]).all()
+    assert ((rsi[13:] >= 0) & (rsi[13:] <= 100)).all()
+
+
+def test_rsi_of_rising_series_is_100():
+    rsi = _rsi(np.linspace(10, 20, 60))
+    np.testing.assert_allclose(rsi[14:], 100.0)
@@ -7,17 +7,43 @@ with open('src/App.tsx', 'r') as f:
     content = f.read()
 
 # 找到分析结果部分（从 {analysisResult && 到 </Tabs>）
-import re
+# 用字符串定位锚点再切片，不用 DOTALL 正则在整个文件上回溯
+START_ANCHOR = '{analysisResult && ('
+END_ANCHOR = '</Tabs>'
 
-# 提取分析结果部分
-analysis_pattern = r'(\s+\{analysisResult && \(\s+<Tabs[^>]*>.*?\s+</Tabs>\s+\)\})'
-analysis_match = re.search(analysis_pattern, content, re.DOTALL)
 
-if not analysis_match:
+def find_analysis_block(text):
+    """返回包含前导空白的分析结果块（{analysisResult && ( <Tabs ...> ... </Tabs> )}），找不到返回 None"""
+    start = text.find(START_ANCHOR)
+    while start != -1:
+        # 锚点前必须有空白，块从这段空白的开头算起
+        block_start = start
+        while block_start > 0 and text[block_start - 1].isspace():
+            block_start -= 1
+        body = start + len(START_ANCHOR)
+        tabs = body
+        while tabs < len(text) and text[tabs].isspace():
+            tabs += 1
+        if block_start < start and tabs > body and text.startswith('<Tabs', tabs):
+            # 找到第一个后面紧跟 “)}” 的 </Tabs>
+            end = text.find(END_ANCHOR, tabs)
+            while end != -1:
+                close = end + len(END_ANCHOR)
+                while close < len(text) and text[close].isspace():
+                    close += 1
+                if close > end + len(END_ANCHOR) and text.startswith(')}', close) and text[end - 1].isspace():
+                    return text[block_start:close + 2]
+                end = text.find(END_ANCHOR, end + 1)
+        start = text.find(START_ANCHOR, start + 1)
+    return None
+
+
+analysis_block = find_analysis_block(content)
+
+if not analysis_block:
     print("❌ 没有找到分析结果部分")
     exit(1)
 
-analysis_block = analysis_match.group(1)
 print(f"✅ 找到分析结果部分，长度: {len(analysis_block)}")
 
 # 从原位置删除分析结果
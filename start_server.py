@@ -4,51 +4,187 @@
 同时启动前端和后端服务
 """
 
+import asyncio
+import hashlib
 import subprocess
 import sys
 import os
-import time
+import shutil
 import signal
-from threading import Thread
 
-def start_backend():
+# 子进程使用与启动器相同的解释器（绝对路径，exec 时无需搜索 PATH，也保证依赖一致）；
+# 嵌入式环境下 sys.executable 可能为空，此时才退回 PATH 中的 python3
+PYTHON = sys.executable or shutil.which('python3') or 'python3'
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(ROOT_DIR, 'backend')
+DIST_DIR = os.path.join(ROOT_DIR, 'dist')
+REQUIREMENTS_FILE = os.path.join(BACKEND_DIR, 'requirements.txt')
+DEPS_SENTINEL = os.path.join(ROOT_DIR, '.deps_ok')
+GUNICORN_CONFIG = os.path.join(BACKEND_DIR, 'gunicorn.conf.py')
+BACKEND_SCRIPT = os.path.join(BACKEND_DIR, 'app.py')
+
+BACKEND_PORT = 8000
+FRONTEND_PORT = 8080
+LOG_QUEUE_SIZE = 10000  # 日志队列满时读取子进程输出的协程等待写出
+LOG_BATCH_SIZE = 256
+LOG_LINE_LIMIT = 1024 * 1024  # 子进程输出管道的单行缓冲上限，超长行按块转发
+# 秒；SIGTERM 后超过该时间仍未退出的子进程发送 SIGKILL。比 gunicorn 的 graceful_timeout
+# （gunicorn.conf.py，同一环境变量）多留几秒，让进行中的请求正常结束
+SHUTDOWN_GRACE = float(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30)) + 5
+READY_TIMEOUT = 60  # 秒；后端首次启动需加载 pandas/sklearn 等，较慢
+
+async def spawn(*cmd):
+    """
+    启动子进程并捕获 stdout/stderr
+    
+    不传 cwd、不关闭继承的 fd（Python 创建的 fd 包括 pidfd 默认都带 O_CLOEXEC，不会泄漏给子进程），
+    使 subprocess 走 posix_spawn 快速路径而不是 fork+exec；工作目录由命令参数指定。
+    子进程的 stdout 接的是管道，Python 默认按块缓冲，设置 PYTHONUNBUFFERED 使日志逐行到达
+    """
+    return await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env={**os.environ, 'PYTHONUNBUFFERED': '1'},
+        close_fds=False,
+        limit=LOG_LINE_LIMIT
+    )
+
+async def start_backend():
     """启动后端Flask服务"""
     print("🚀 启动后端服务...")
-    backend_path = os.path.join(os.path.dirname(__file__), 'backend')
-    return subprocess.Popen(
-        [sys.executable, 'app.py'],
-        cwd=backend_path,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
+    # 已安装 gunicorn 时用它启动（多线程 worker），否则退回 Flask 开发服务器
+    try:
+        import gunicorn
+        cmd = [PYTHON, '-m', 'gunicorn', '--chdir', BACKEND_DIR, '-c', GUNICORN_CONFIG, 'app:app']
+    except ImportError:
+        cmd = [PYTHON, BACKEND_SCRIPT]
+    return await spawn(*cmd)
+
+# 前端静态服务：多线程并行处理资源请求，HTTP/1.1 保持连接
+# （python -m http.server 默认是 HTTP/1.0，每个资源都要重新建立连接）
+FRONTEND_SERVER = '''
+import sys
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+class Handler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
 
-def start_frontend():
+port, directory = int(sys.argv[1]), sys.argv[2]
+server = ThreadingHTTPServer(('', port), partial(Handler, directory=directory))
+print(f'Serving HTTP on 0.0.0.0 port {port} (http://0.0.0.0:{port}/) ...', flush=True)
+server.serve_forever()
+'''
+
+async def start_frontend():
     """启动前端预览服务"""
     print("🌐 启动前端服务...")
-    return subprocess.Popen(
-        ['python3', '-m', 'http.server', '8080'],
-        cwd=os.path.join(os.path.dirname(__file__), 'dist'),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True
-    )
+    return await spawn(PYTHON, '-c', FRONTEND_SERVER, str(FRONTEND_PORT), DIST_DIR)
 
-def log_output(process, name, stream):
-    """输出日志"""
+async def log_output(stream, name, queue):
+    """逐行读取子进程输出放入日志队列（由事件循环驱动，不占用线程；按字节转发，不解码）"""
+    prefix = f"[{name}] ".encode()
+    split = False  # 上一块是被截断的超长行
     while True:
-        output = stream.readline()
-        if output:
-            print(f"[{name}] {output.strip()}")
-        if process.poll() is not None:
-            break
+        try:
+            line = await stream.readuntil(b'\n')
+        except asyncio.IncompleteReadError as e:
+            # 输出结束，转发没有换行符的最后一行
+            if e.partial:
+                await queue.put(prefix + e.partial + b'\n')
+            return
+        except asyncio.LimitOverrunError as e:
+            # 超过缓冲上限的长行（如巨大的 repr）：先转发已缓冲的部分，继续读取，避免管道无人读取导致子进程阻塞
+            chunk = await stream.read(max(e.consumed, 1))
+            await queue.put(prefix + chunk + b'\n')
+            split = True
+            continue
+        if not (split and line == b'\n'):
+            await queue.put(prefix + line)
+        split = False
 
-def main():
-    print("=" * 60)
-    print("量化投资分析系统 - 启动器")
-    print("=" * 60)
+async def write_logs(queue):
+    """唯一的日志写出者：把队列中已有的日志合并为一次 write + flush，收到 None 时结束"""
+    while True:
+        batch = [await queue.get()]
+        while len(batch) < LOG_BATCH_SIZE and not queue.empty():
+            batch.append(queue.get_nowait())
+        done = batch[-1] is None
+        if done:
+            batch.pop()
+        if batch:
+            # 先刷新文本层中启动器自己 print 的内容，保证输出顺序
+            sys.stdout.flush()
+            sys.stdout.buffer.write(b''.join(batch))
+            sys.stdout.buffer.flush()
+        if done:
+            return
+
+async def wait_exit(process):
+    """
+    等待子进程退出
+    
+    Linux 5.3+ 用 pidfd_open 得到进程描述符，注册到事件循环的 epoll 上，进程退出时才被唤醒；
+    不支持时退回 asyncio 自带的子进程等待；已被回收的进程（pid 可能已被复用）直接走 process.wait()
+    """
+    if process.returncode is not None:
+        return await process.wait()
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(process.pid)
+    except (AttributeError, OSError):
+        return await process.wait()
+    
+    exited = loop.create_future()
+    try:
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    except (NotImplementedError, ValueError):
+        os.close(pidfd)
+        return await process.wait()
+    # 检查 returncode 到 pidfd_open 之间子进程仍可能被 asyncio 的 watcher 回收，同时等待 process.wait()，
+    # 即使 pidfd 指向了复用该 pid 的无关进程也不会一直等下去
+    reaped = asyncio.ensure_future(process.wait())
+    try:
+        await asyncio.wait([exited, reaped], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+    return await reaped
+
+async def wait_port_ready(process, port: int) -> bool:
+    """探测服务端口直到可以连接；进程提前退出或超时返回 False"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + READY_TIMEOUT
+    while process.returncode is None and loop.time() < deadline:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+        except OSError:
+            await asyncio.sleep(0.05)
+            continue
+        writer.close()
+        await writer.wait_closed()
+        return True
+    return False
+
+def requirements_digest() -> str:
+    """依赖清单和当前解释器的摘要，任一变化都需要重新检查依赖"""
+    with open(REQUIREMENTS_FILE, 'rb') as f:
+        content = f.read()
+    return hashlib.sha1(content + PYTHON.encode()).hexdigest()
+
+def check_dependencies():
+    """检查依赖，缺失时安装；检查通过后写入 .deps_ok，依赖清单未变时下次直接跳过"""
+    digest = requirements_digest()
+    try:
+        with open(DEPS_SENTINEL) as f:
+            if f.read().strip() == digest:
+                print("✅ 依赖检查通过（缓存）")
+                return
+    except OSError:
+        pass
     
-    # 检查依赖
     try:
         import flask
         import longport
@@ -56,48 +192,121 @@ def main():
     except ImportError as e:
         print(f"⚠️ 缺少依赖: {e}")
         print("正在安装依赖...")
-        subprocess.run([sys.executable, '-m', 'pip', 'install', '-r', 'backend/requirements.txt'], 
-                      cwd=os.path.dirname(__file__))
+        result = subprocess.run([PYTHON, '-m', 'pip', 'install', '-r', REQUIREMENTS_FILE])
+        if result.returncode != 0:
+            return
     
-    # 启动服务
-    backend = start_backend()
-    time.sleep(2)  # 等待后端启动
-    frontend = start_frontend()
-    
-    print("\n" + "=" * 60)
-    print("✅ 服务已启动!")
+    with open(DEPS_SENTINEL, 'w') as f:
+        f.write(digest)
+
+def signal_process(process, force: bool = False):
+    """向仍在运行的子进程发送 SIGTERM（force 时发送 SIGKILL）"""
+    if process.returncode is None:
+        try:
+            if force:
+                process.kill()
+            else:
+                process.terminate()
+        except ProcessLookupError:
+            pass
+
+async def stop_processes(*processes):
+    """同时向所有子进程发送 SIGTERM，宽限期内未退出的发送 SIGKILL，返回前全部回收"""
+    for process in processes:
+        signal_process(process)
+    exits = [asyncio.create_task(wait_exit(process)) for process in processes]
+    await asyncio.wait(exits, timeout=SHUTDOWN_GRACE)
+    for process in processes:
+        if process.returncode is None:
+            print(f"⚠️ 进程 {process.pid} 未在 {SHUTDOWN_GRACE:g} 秒内退出，强制结束")
+            signal_process(process, force=True)
+    await asyncio.gather(*exits)
+
+async def main():
     print("=" * 60)
-    print("📊 前端界面: http://localhost:8080")
-    print("🔧 后端API: http://localhost:8000")
+    print("量化投资分析系统 - 启动器")
     print("=" * 60)
-    print("按 Ctrl+C 停止服务\n")
     
-    # 启动日志线程 (stdout 和 stderr)
-    backend_log = Thread(target=log_output, args=(backend, 'BACKEND', backend.stdout))
-    backend_err = Thread(target=log_output, args=(backend, 'BACKEND', backend.stderr))
-    frontend_log = Thread(target=log_output, args=(frontend, 'FRONTEND', frontend.stdout))
-    frontend_err = Thread(target=log_output, args=(frontend, 'FRONTEND', frontend.stderr))
-    for t in [backend_log, backend_err, frontend_log, frontend_err]:
-        t.daemon = True
-        t.start()
+    # Ctrl+C / SIGTERM 通过事件通知主协程，启动子进程前就注册（Windows 不支持 add_signal_handler，仍走 KeyboardInterrupt）
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    
+    # 检查依赖
+    check_dependencies()
+    
+    # 同时启动前后端（前端不依赖后端）
+    backend, frontend = await asyncio.gather(start_backend(), start_frontend())
+    
+    # 日志任务 (stdout 和 stderr)，启动阶段的输出也立即转发
+    log_queue = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+    log_writer = asyncio.create_task(write_logs(log_queue))
+    log_tasks = [
+        asyncio.create_task(log_output(backend.stdout, 'BACKEND', log_queue)),
+        asyncio.create_task(log_output(backend.stderr, 'BACKEND', log_queue)),
+        asyncio.create_task(log_output(frontend.stdout, 'FRONTEND', log_queue)),
+        asyncio.create_task(log_output(frontend.stderr, 'FRONTEND', log_queue)),
+    ]
     
-    # 等待中断
+    exit_messages = {}
+    stop_task = asyncio.create_task(stop.wait())
     try:
-        while True:
-            time.sleep(1)
-            # 检查进程状态
-            if backend.poll() is not None:
-                print("❌ 后端服务已停止")
-                break
-            if frontend.poll() is not None:
-                print("❌ 前端服务已停止")
-                break
-    except KeyboardInterrupt:
-        print("\n🛑 正在停止服务...")
+        # 同时等待两个端口就绪（按 Ctrl+C 也会立即结束等待）；启动期间被中断则不打印启动成功
+        if not stop.is_set():
+            ready = asyncio.gather(
+                wait_port_ready(backend, BACKEND_PORT),
+                wait_port_ready(frontend, FRONTEND_PORT)
+            )
+            await asyncio.wait([ready, stop_task], return_when=asyncio.FIRST_COMPLETED)
+            if ready.done() and not stop.is_set():
+                for name, process, ok in zip(('后端', '前端'), (backend, frontend), ready.result()):
+                    if not ok and process.returncode is None:
+                        print(f"⚠️ {name} {READY_TIMEOUT} 秒内未就绪")
+            ready.cancel()
+        
+        if stop.is_set():
+            print("\n🛑 正在停止服务...")
+            return
+        
+        print("\n" + "=" * 60)
+        print("✅ 服务已启动!")
+        print("=" * 60)
+        print(f"📊 前端界面: http://localhost:{FRONTEND_PORT}")
+        print(f"🔧 后端API: http://localhost:{BACKEND_PORT}")
+        print("=" * 60)
+        print("按 Ctrl+C 停止服务\n")
+        
+        # 等待中断或任一子进程退出：信号经 add_signal_handler 的 set_wakeup_fd 自管道、子进程退出经 pidfd，
+        # 都注册在事件循环同一个 epoll 上，空闲时主进程完全阻塞在一次 epoll_wait 中
+        exit_messages = {
+            asyncio.create_task(wait_exit(backend)): "❌ 后端服务已停止",
+            asyncio.create_task(wait_exit(frontend)): "❌ 前端服务已停止",
+        }
+        done, _ = await asyncio.wait([*exit_messages, stop_task], return_when=asyncio.FIRST_COMPLETED)
+        if stop_task in done:
+            print("\n🛑 正在停止服务...")
+        for task in exit_messages:
+            if task in done:
+                print(exit_messages[task])
     finally:
-        backend.terminate()
-        frontend.terminate()
+        for task in exit_messages:
+            task.cancel()
+        await stop_processes(backend, frontend)
+        # 读完子进程剩余输出；孙进程（如 gunicorn worker）可能仍持有管道，最多等1秒
+        await asyncio.wait(log_tasks, timeout=1)
+        for task in log_tasks:
+            task.cancel()
+        await log_queue.put(None)
+        await log_writer
+        stop_task.cancel()
         print("✅ 服务已停止")
 
 if __name__ == '__main__':
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass